@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark of resolving embedded selectors in glossary construction.
+
+Generates a glossary in which each concept has, besides regular content,
+a description holding two wide embedded selectors, and reports the best
+time of constructing it over several repeats::
+
+    $ python bench/embsel.py [-c CONCEPTS] [-e ENVIRONMENTS] [-p] [GLOSSDIR]
+
+The glossary is generated by L{genglos} into the given directory,
+or into a temporary one which is removed afterwards. With profiling,
+the construction is run once more under the profiler, and the cumulative
+time spent in resolving embedded selectors is reported.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import cProfile
+import pstats
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dg.construct
+from genglos import write_glossary
+
+
+def main ():
+
+    opars = OptionParser(usage="%prog [-c CONCEPTS] [-e ENVIRONMENTS] [-p] "
+                               "[GLOSSDIR]")
+    opars.add_option("-c", "--concepts", type="int", default=1000,
+                     help="number of concepts")
+    opars.add_option("-e", "--environments", type="int", default=30,
+                     help="number of environments, all of them in selectors")
+    opars.add_option("-r", "--repeat", type="int", default=3,
+                     help="number of repeats, of which the best is taken")
+    opars.add_option("-p", "--profile", action="store_true", default=False,
+                     help="report time in resolving embedded selectors")
+    options, args = opars.parse_args()
+
+    if args:
+        outdir = args[0]
+    else:
+        outdir = tempfile.mkdtemp(prefix="dgbench-")
+    try:
+        dgfile = write_glossary(outdir, options.concepts, options.environments,
+                                nselenvs=options.environments)
+
+        times = []
+        for i in range(options.repeat):
+            t0 = time.time()
+            dg.construct.from_file(dgfile)
+            times.append(time.time() - t0)
+        print "construction     best %7.3f s, worst %7.3f s" % (min(times),
+                                                                max(times))
+
+        if options.profile:
+            prof = cProfile.Profile()
+            prof.runcall(dg.construct.from_file, dgfile)
+            stats = pstats.Stats(prof).stats
+            t_embsel = sum(x[3] for k, x in stats.items()
+                           if k[2] == "_res_embsel")
+            print "_res_embsel      %7.3f s, under profiler" % t_embsel
+    finally:
+        if not args:
+            shutil.rmtree(outdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Generate synthetic glossaries for benchmarks.
+
+The glossary has languages C{en} and C{sr}, the given number of
+environments (each close to the previous one), and concepts spread over
+one included file per topic. Each concept has descriptions with references,
+emphasis, foreign phrases, links and an embedded selector, several terms
+with declensions, details, origins and comments::
+
+    $ python bench/genglos.py CONCEPTS ENVIRONMENTS OUTDIR [TOPICS [SELENVS]]
+
+With C{SELENVS} greater than zero, each concept gets another description
+with two embedded selectors over that many environments.
+Generation is deterministic, so the same arguments give the same glossary.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import sys
+import os
+import random
+
+
+_words = ["alpha", "beta", "gamma", "delta", "star", "planet", "nova",
+          "orbit", "comet", "dust"]
+_words_sr = [u"алфа", u"бета", u"гама", u"делта", u"звезда", u"планета",
+             u"нова", u"орбита", u"комета", u"прашина"]
+
+
+def write_glossary (outdir, nconcepts, nenvs, ntopics=3, nselenvs=0):
+    """
+    Write a synthetic glossary into a directory.
+
+    @param outdir: directory to write the glossary files into
+    @type outdir: string
+    @param nconcepts: number of concepts
+    @type nconcepts: int
+    @param nenvs: number of environments
+    @type nenvs: int
+    @param ntopics: number of topics, and of included concept files
+    @type ntopics: int
+    @param nselenvs: environments in additional wide embedded selectors
+    @type nselenvs: int
+
+    @return: path of the main glossary file
+    @rtype: string
+    """
+
+    rnd = random.Random(42)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    envs = ["e%d" % i for i in range(nenvs)]
+    ckeys = ["c%d" % i for i in range(nconcepts)]
+
+    lines = []
+    w = lines.append
+    w(u'<?xml version="1.0" encoding="UTF-8"?>')
+    w(u'<!DOCTYPE glossary SYSTEM "divergloss.dtd">')
+    w(u'<glossary id="tgloss" lang="en" env="e0" '
+      u'xmlns:xi="http://www.w3.org/2001/XInclude">')
+    w(u'<metadata><title>Test ~e0:Glossary|e1:Gloss~</title>'
+      u'<title lang="sr">Тест речник</title>'
+      u'<desc>Some <em>desc</em>.</desc>'
+      u'<version>1.0</version><date>2008</date></metadata>')
+    w(u'<keydefs><languages>')
+    w(u'<language id="en"><name>English</name><name lang="sr">енглески</name>'
+      u'<shortname>En.</shortname><shortname lang="sr">енг.</shortname>'
+      u'</language>')
+    w(u'<language id="sr"><name>Serbian</name><name lang="sr">српски</name>'
+      u'<shortname>Sr.</shortname><shortname lang="sr">срп.</shortname>'
+      u'</language>')
+    w(u'</languages><environments>')
+    for i, env in enumerate(envs):
+        closeto = ""
+        if i > 0:
+            closeto = ' closeto="%s"' % envs[i - 1]
+        w(u'<environment id="%s" weight="%d"%s><name>Env %d</name>'
+          u'<name lang="sr">Окр %d</name><shortname>E%d</shortname>'
+          u'<shortname lang="sr">О%d</shortname><desc>Environment %d.</desc>'
+          u'<desc lang="sr">Окружење %d.</desc></environment>'
+          % (env, i % 3, closeto, i, i, i, i, i, i))
+    w(u'</environments><editors>')
+    w(u'<editor id="ed1"><name>Ed One</name><shortname>EO</shortname>'
+      u'<email>ed@x.org</email><affiliation>Org</affiliation>'
+      u'<desc>An editor.</desc></editor>')
+    w(u'</editors><sources><source id="s1"><name>Source</name>'
+      u'<shortname>S</shortname><url>http://s.org</url>'
+      u'<desc>A source.</desc></source></sources>')
+    w(u'<topics>')
+    for t in range(ntopics):
+        w(u'<topic id="t%d"><name>Topic %d</name><name lang="sr">Тема %d</name>'
+          u'<shortname>T%d</shortname><shortname lang="sr">Т%d</shortname>'
+          u'<desc>Topic %d.</desc></topic>' % (t, t, t, t, t, t))
+    w(u'</topics><levels><level id="l1"><name>Basic</name>'
+      u'<shortname>B</shortname></level></levels>')
+    w(u'<grammar><gramm id="n"><name>noun</name><name lang="sr">именица</name>'
+      u'<shortname>n.</shortname><shortname lang="sr">им.</shortname>'
+      u'</gramm></grammar>')
+    w(u'<extroots><extroot id="wp"><name>Wikipedia</name>'
+      u'<shortname>WP</shortname>'
+      u'<rooturl>http://en.wikipedia.org/wiki/</rooturl></extroot>'
+      u'<extroot id="wpsr"><name>Wikipedia sr</name>'
+      u'<shortname>WPsr</shortname>'
+      u'<rooturl>http://sr.wikipedia.org/sr-ec/</rooturl></extroot>'
+      u'</extroots>')
+    w(u'</keydefs>')
+
+    for t in range(ntopics):
+        fname = "concepts-t%d.xml" % t
+        ofl = open(os.path.join(outdir, fname), "w")
+        ofl.write('<?xml version="1.0" encoding="UTF-8"?>\n<concepts>\n')
+        for i in range(t, nconcepts, ntopics):
+            text = _concept(rnd, i, ckeys, envs, ntopics, nselenvs)
+            ofl.write((text + u"\n").encode("UTF-8"))
+        ofl.write('</concepts>\n')
+        ofl.close()
+        w(u'<xi:include href="%s"/>' % fname)
+    w(u'</glossary>')
+
+    fpath = os.path.join(outdir, "gloss.xml")
+    ofl = open(fpath, "w")
+    ofl.write((u"\n".join(lines) + u"\n").encode("UTF-8"))
+    ofl.close()
+
+    return fpath
+
+
+# Format a single concept.
+def _concept (rnd, i, ckeys, envs, ntopics, nselenvs):
+
+    lines = []
+    a = lines.append
+    n = len(ckeys)
+    word, word_sr = _words[i % 10], _words_sr[i % 10]
+
+    related = ""
+    if i > 0:
+        related = ' related="%s"' % ckeys[rnd.randrange(i)]
+    a(u'<concept id="%s" topic="t%d" level="l1"%s>'
+      % (ckeys[i], i % ntopics, related))
+    ref = ckeys[rnd.randrange(n)]
+    if nselenvs:
+        sel = u"|".join(["%s:variant %d" % (envs[k], k)
+                         for k in range(min(nselenvs, len(envs)))])
+        a(u'<desc lang="en" env="%s">Wide <em>~%s~</em> selector ~%s~.</desc>'
+          % (" ".join(envs[:nselenvs]), sel, sel))
+    a(u'<desc by="ed1" src="s1">A %s thing, see <ref c="%s">other</ref> '
+      u'and <em>this</em>, <ol lang="sr" wl="1">%s</ol>, '
+      u'<link url="http://x.org/%d">link &amp; "q" \'a\' &lt;</link>. '
+      u'~%s:First env|%s:Second env~ text.</desc>'
+      % (word, ref, word_sr, i, envs[0], envs[min(1, len(envs) - 1)]))
+    a(u'<ldesc lang="sr"><para>Опис %s <ref c="%s">други</ref>.</para>'
+      u'<para>Други пасус.</para></ldesc>' % (word_sr, ref))
+    a(u'<term gr="n">%s %d</term>' % (word, i))
+    a(u'<term env="%s">%s-alt %d</term>' % (envs[-1], _words[(i + 3) % 10], i))
+    a(u'<eterm lang="sr" gr="n"><nom>%s %d</nom><stem>%s</stem>'
+      u'<decl gr="n">%sа</decl><origin>Од ~%s:једно|%s:друго~.</origin>'
+      u'<comment>Коментар.</comment></eterm>'
+      % (word_sr, i, word_sr, word_sr, envs[0], envs[-1]))
+    a(u'<details root="wp" rel="%s">Wiki</details>' % word)
+    a(u'<details lang="sr" root="wpsr" rel="%s">Вики</details>' % word)
+    a(u'<origin>From Latin.</origin><comment by="ed1">A comment.</comment>')
+    a(u'</concept>')
+
+    return u"".join(lines)
+
+
+def main ():
+
+    args = sys.argv[1:]
+    if len(args) < 3:
+        print >>sys.stderr, ("usage: %s CONCEPTS ENVIRONMENTS OUTDIR "
+                             "[TOPICS [SELENVS]]" % sys.argv[0])
+        sys.exit(1)
+    nconcepts, nenvs, outdir = int(args[0]), int(args[1]), args[2]
+    ntopics = int(args[3]) if len(args) > 3 else 3
+    nselenvs = int(args[4]) if len(args) > 4 else 0
+
+    print write_glossary(outdir, nconcepts, nenvs, ntopics, nselenvs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark of language-aware sorting in dg.util.
+
+Sorts random Latin and Cyrillic terms with L{dg.util.langsort} and
+L{dg.util.langsort_tuples}, as one large list (first with empty and then
+with filled key caches) and as many small lists, like sieves do per entry::
+
+    $ python bench/langsort.py [-t TERMS] [-l LANG ...]
+
+Languages are given by their keys, and C{none} stands for the current
+locale. For each language, a digest of the sorted order is reported too,
+so that orders can be compared between revisions.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import sys
+import os
+import time
+import random
+import hashlib
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dg.util import langsort, langsort_tuples
+
+
+def main ():
+
+    opars = OptionParser(usage="%prog [-t TERMS] [-l LANG ...]")
+    opars.add_option("-t", "--terms", type="int", default=100000,
+                     help="number of terms to sort")
+    opars.add_option("-g", "--group", type="int", default=5,
+                     help="size of small lists")
+    opars.add_option("-l", "--lang", action="append", default=[],
+                     help="language to sort by, 'none' for current locale "
+                          "(default: none and sr)")
+    options, args = opars.parse_args()
+    langs = options.lang or ["none", "sr"]
+
+    rnd = random.Random(1)
+    alpha = (u"abcčćdđefghijklmnoprsštuvzž"
+             u"абвгдђежзијклљмнњопрстћуфхцчџш ABCŠŽ")
+    terms = [u"".join(rnd.choice(alpha) for j in range(rnd.randint(3, 15)))
+             for i in range(options.terms)]
+
+    for lang in langs:
+        if lang == "none":
+            lang = None
+
+        lst = list(terms)
+        t_cold = _timed(langsort, lst, lang)
+        digest = hashlib.md5(u"\n".join(lst).encode("UTF-8")).hexdigest()
+        lst = list(terms)
+        t_warm = _timed(langsort, lst, lang)
+        tuples = [(x, i) for i, x in enumerate(terms)]
+        t_tuples = _timed(langsort_tuples, tuples, 0, lang)
+
+        groups = [terms[i:i + options.group]
+                  for i in range(0, len(terms), options.group)]
+        def sort_groups ():
+            for group in groups:
+                langsort_tuples([(x, 0) for x in group], 0, lang)
+        t_groups = _timed(sort_groups)
+
+        print "lang=%s" % lang
+        print "  langsort, cold keys    %7.3f s" % t_cold
+        print "  langsort, warm keys    %7.3f s" % t_warm
+        print "  langsort_tuples        %7.3f s" % t_tuples
+        print "  %d small sorts      %7.3f s" % (len(groups), t_groups)
+        print "  order digest           %s" % digest
+
+
+def _timed (func, *args):
+
+    t0 = time.time()
+    func(*args)
+    return time.time() - t0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Micro-benchmarks of XML escaping and tag builders in dg.textfmt.
+
+Reports the best time per call, in microseconds, over several repeats::
+
+    $ python bench/textfmt.py [-n NUMBER] [-r REPEAT]
+
+To compare two revisions, run the script from the working trees of both.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import sys
+import os
+import timeit
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dg.textfmt import escape_xml, stag, wtext
+
+
+def main ():
+
+    opars = OptionParser(usage="%prog [-n NUMBER] [-r REPEAT]")
+    opars.add_option("-n", "--number", type="int", default=100000,
+                     help="calls per repeat")
+    opars.add_option("-r", "--repeat", type="int", default=5,
+                     help="number of repeats, of which the best is taken")
+    options, args = opars.parse_args()
+
+    plain = u"a somewhat longer description of a concept"
+    special = u"Tom's <b> & \"x\""
+
+    cases = [
+        ("escape_xml, plain text",
+         lambda: escape_xml(plain)),
+        ("escape_xml, special characters",
+         lambda: escape_xml(special)),
+        ("stag, one attribute",
+         lambda: stag("td", {"class": "bd-oterm"})),
+        ("stag, two attributes",
+         lambda: stag("a", {"class": "cref", "href": "p1.html#c42"})),
+        ("stag, no attributes",
+         lambda: stag("tr")),
+        ("wtext",
+         lambda: wtext(plain, "p", {"class": "desc"})),
+    ]
+
+    for name, call in cases:
+        best = min(timeit.repeat(call, number=options.number,
+                                 repeat=options.repeat))
+        print "%-32s %6.2f us" % (name, best / options.number * 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark of walking the whole glossary with dg.query.
+
+Constructs a large glossary and walks all of its nodes, counting terms,
+with L{dg.query.descendant_nodes} and, where available,
+L{dg.query.iter_descendants}. Reports the time of each walk and the
+growth of resident memory while it was made, as the best time and
+the largest growth over several repeats::
+
+    $ python bench/traverse.py [-c CONCEPTS] [-e ENVIRONMENTS] [-r REPEAT]
+          [GLOSSFILE]
+
+If no glossary file is given, one is generated by L{genglos}.
+The glossary is walked as loaded from the construction cache,
+so that memory freed after parsing the document does not hide
+the memory taken by the walks.
+Resident memory is read from C{/proc}, so it is reported only on Linux.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import sys
+import os
+import gc
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dg.construct
+import dg.query
+from dg.construct import Term
+from genglos import write_glossary
+
+
+def main ():
+
+    opars = OptionParser(usage="%prog [-c CONCEPTS] [-e ENVIRONMENTS] "
+                               "[-r REPEAT] [GLOSSFILE]")
+    opars.add_option("-c", "--concepts", type="int", default=20000,
+                     help="number of concepts")
+    opars.add_option("-e", "--environments", type="int", default=40,
+                     help="number of environments")
+    opars.add_option("-t", "--topics", type="int", default=8,
+                     help="number of topics")
+    opars.add_option("-r", "--repeat", type="int", default=3,
+                     help="number of repeats of each walk")
+    options, args = opars.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="dgbench-")
+    try:
+        if args:
+            dgfile = args[0]
+        else:
+            dgfile = write_glossary(os.path.join(tmpdir, "gloss"),
+                                    options.concepts, options.environments,
+                                    options.topics)
+        # Fill the cache in a child process, to keep this one's heap clean.
+        cachedir = os.path.join(tmpdir, "cache")
+        pid = os.fork()
+        if pid == 0:
+            dg.construct.from_file(dgfile, validate=False, cachedir=cachedir)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        gloss = dg.construct.from_file(dgfile, validate=False,
+                                       cachedir=cachedir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    def walk_list ():
+        nodes = dg.query.descendant_nodes(gloss)
+        nterms = len([x for x in nodes if isinstance(x, Term)])
+        return len(nodes), nterms, _rss()
+
+    def walk_iter ():
+        nnodes = nterms = 0
+        for node in dg.query.iter_descendants(gloss):
+            nnodes += 1
+            if isinstance(node, Term):
+                nterms += 1
+        return nnodes, nterms, _rss()
+
+    walks = [("descendant_nodes", walk_list)]
+    if hasattr(dg.query, "iter_descendants"):
+        walks.append(("iter_descendants", walk_iter))
+
+    for name, walk in walks:
+        times = []; growths = []
+        for i in range(options.repeat):
+            gc.collect()
+            rss0 = _rss()
+            t0 = time.time()
+            nnodes, nterms, rss1 = walk()
+            times.append(time.time() - t0)
+            growths.append(rss1 - rss0)
+        print ("%-18s %7.3f s  %5.1f MB  (%d nodes, %d terms)"
+               % (name, min(times), max(growths) / 1024.0 ** 2,
+                  nnodes, nterms))
+
+
+# Current resident memory of the process, in bytes.
+def _rss ():
+
+    try:
+        fields = open("/proc/self/statm").read().split()
+    except IOError:
+        return 0
+    return int(fields[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+if __name__ == "__main__":
+    main()
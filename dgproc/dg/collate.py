@@ -0,0 +1,220 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Collate text by language, independently of system locales.
+
+Sort keys are computed from per-language alphabet tables, in several levels
+as in the Unicode collation algorithm: letters first, then diacritics,
+then case (and kana type), and finally the text itself, so that
+different texts never compare equal. Keys are plain Unicode strings,
+compared as such, and no global locale state is touched in computing them.
+
+Letters not in the language tables are ordered after those in the tables,
+by their Unicode code points, and whitespace and punctuation are ignored
+except at the final level. For Japanese, kana are ordered by the gojūon
+order, while kanji are ordered only by their code points.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import unicodedata
+
+
+_latin = u"a b c d e f g h i j k l m n o p q r s t u v w x y z".split()
+_sr_latin = (u"a b c č ć d dž đ e f g h i j k l lj m n nj o p q r s š t u "
+             u"v w x y z ž").split()
+_sr_cyrillic = (u"а б в г д ђ е ж з и ј к л љ м н њ о п р с т ћ у ф х ц ч "
+                u"џ ш").split()
+_hiragana = list(u"あいうえおかきくけこさしすせそたちつてとなにぬねの"
+                 u"はひふへほまみむめもやゆよらりるれろわゐゑをん")
+
+# Alphabets by language, in order of precedence.
+# Elements are lowercase letters or letter sequences sorted as one letter.
+_lang_alphabets = {
+    "en": [_latin],
+    "sr": [_sr_cyrillic, _sr_latin],
+    "sr@latin": [_sr_latin, _sr_cyrillic],
+    "ja": [_latin, _hiragana],
+}
+
+# Small kana, mapped to their normal counterparts.
+_small_kana = dict(zip(u"ぁぃぅぇぉっゃゅょゎ", u"あいうえおつやゆよわ"))
+
+# Weights are code points of characters in sort keys.
+_level_sep = u"\x01"
+_weight_none = 2
+_weight_case = 0x10
+_weight_digit = 0x0100
+_weight_table = 0x0200
+_weight_other = 0x0800
+_weight_max = 0xffff
+
+
+class Collator (object):
+    """
+    Sort key provider for a language.
+
+    Computed keys are cached, so each text is processed only once
+    per collator.
+    """
+
+    def __init__ (self, lang=None):
+        """
+        Constructor.
+
+        If there are no alphabet tables for the language, only the
+        language-independent ordering by code points is applied.
+
+        @param lang: language of the collation
+        @type lang: string or C{None}
+        """
+
+        self.lang = lang
+
+        self._ranks = {}
+        for alphabet in _lang_alphabets.get(lang, []):
+            for elem in alphabet:
+                if elem not in self._ranks:
+                    self._ranks[elem] = len(self._ranks)
+        self._contr_starts = set(x[0] for x in self._ranks if len(x) > 1)
+
+        self._elements = {}
+        self._keys = {}
+
+
+    def key (self, text):
+        """
+        Compute the sort key for the text.
+
+        @param text: text to compute the key for
+        @type text: string
+
+        @return: sort key
+        @rtype: unicode
+        """
+
+        key = self._keys.get(text)
+        if key is None:
+            key = self._compute_key(text)
+            self._keys[text] = key
+        return key
+
+
+    def sort_keys (self, texts):
+        """
+        Compute sort keys for the texts.
+
+        The returned mapping may contain keys of other texts too.
+
+        @param texts: texts to compute the keys for
+        @type texts: sequence of strings
+
+        @return: sort keys by text
+        @rtype: dict
+        """
+
+        keys = self._keys
+        for text in texts:
+            if text not in keys:
+                keys[text] = self._compute_key(text)
+        return keys
+
+
+    def _compute_key (self, text):
+
+        if isinstance(text, str):
+            text = text.decode("UTF-8")
+        text = unicodedata.normalize("NFC", text)
+
+        elements = self._elements
+        prims = []; secs = []; ters = []
+        i = 0
+        ltext = len(text)
+        while i < ltext:
+            unit = text[i]
+            if (    unit.lower() in self._contr_starts
+                and text[i:i + 2].lower() in self._ranks):
+                unit = text[i:i + 2]
+            i += len(unit)
+            elem = elements.get(unit)
+            if elem is None:
+                elem = self._compute_element(unit)
+                elements[unit] = elem
+            prims.append(elem[0])
+            secs.append(elem[1])
+            ters.append(elem[2])
+
+        return _level_sep.join(("".join(prims), "".join(secs), "".join(ters),
+                                text))
+
+
+    def _compute_element (self, unit):
+
+        lunit = unit.lower()
+        tertiary = _weight_case + sum(x != x.lower() for x in unit)
+
+        # Letters with own places in the alphabet.
+        rank = self._ranks.get(lunit)
+        if rank is not None:
+            return (unichr(_weight_table + rank), unichr(_weight_none),
+                    unichr(tertiary))
+
+        # Otherwise order by base letter, and by diacritics after that.
+        decomp = unicodedata.normalize("NFD", lunit)
+        base, marks = decomp[0], decomp[1:]
+        if u"ァ" <= base <= u"ヶ":
+            base = unichr(ord(base) - 0x60)
+            tertiary += 0x04
+        if base in _small_kana:
+            base = _small_kana[base]
+            tertiary -= 0x08
+
+        rank = self._ranks.get(base)
+        cat = unicodedata.category(base)
+        if rank is not None:
+            primary = unichr(_weight_table + rank)
+        elif cat == "Nd":
+            primary = unichr(_weight_digit + unicodedata.digit(base))
+        elif cat[0] in ("L", "N"):
+            primary = unichr(min(_weight_other + ord(base), _weight_max))
+        elif cat[0] == "M":
+            return (u"", base + marks, u"")
+        else:
+            # Whitespace, punctuation, symbols, etc.
+            return (u"", u"", u"")
+
+        return primary, unichr(_weight_none) + marks, unichr(tertiary)
+
+
+_collators = {}
+
+def collator (lang=None):
+    """
+    Get the collator for a language.
+
+    Collators are created once per language and shared afterwards.
+
+    @param lang: language of the collation
+    @type lang: string or C{None}
+
+    @return: the collator
+    @rtype: L{Collator}
+    """
+
+    coll = _collators.get(lang)
+    if coll is None:
+        coll = Collator(lang)
+        _collators[lang] = coll
+    return coll
+
+
+def collation_languages ():
+    """
+    Get languages which have their own collation tables.
+
+    @return: language keys
+    @rtype: list of strings
+    """
+
+    return sorted(_lang_alphabets)
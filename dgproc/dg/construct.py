@@ -18,16 +18,16 @@ elements are represented by objects of the L{Concept} subclass of L{Gnode}.
 A g-node may have data attributes of types as follows:
 
   - string: used to represent XML element attributes
-  - list of strings: used to represent list-valued XML element attributes
+  - tuple of strings: used to represent list-valued XML element attributes
   - g-node: for non-repeating children of an XML element
   - list of g-nodes: repeating children XML elements without a unique ID
   - dict of g-nodes: repeating children having a unique ID
   - d-set of g-nodes: repeating children having C{lang}/C{env} attributes
 
-String and list of string attributes are just that, named as the underlying
-XML attribute and having its value or list of values. E.g. if the top
+String and tuple of string attributes are just that, named as the underlying
+XML attribute and having its value or tuple of values. E.g. if the top
 glossary node is C{gloss}, and there is a concept with the ID C{con},
-the list of its related concepts (i.e. their keys) may be reached by
+the tuple of its related concepts (i.e. their keys) may be reached by
 C{gloss.concepts[con].related}.
 
 XML elements which are unique children of their parent are represented by
@@ -78,7 +78,7 @@ Additional notes on the structure:
 
   - The C{env} attribute, when present in a g-node, will never be an
     empty sequence. It is, like language, inherited from first parent
-    g-node that has it, and the top g-node will set it to C{[None]} if
+    g-node that has it, and the top g-node will set it to C{(None,)} if
     not explicitly provided.
 
   - Each g-node has a C{parent} attribute, which points to the parent g-node.
@@ -88,6 +88,12 @@ Additional notes on the structure:
   - D-sets may be queried without providing language and environment
     parameters, in which case they use langenv of their parent.
 
+  - The glossary keeps a registry of all its nodes by type
+    (L{Glossary.nodes_by_type}), from which selections by type are made.
+    Client code which adds or removes g-nodes, e.g. a sieve passing
+    a modified glossary to the next one, must report them to the registry
+    by L{register_nodes} and L{unregister_nodes}.
+
 See L{Glossary} for full hierarchical overview of data attributes.
 
 Text Representation
@@ -133,95 +139,688 @@ the formatter and search on the plain text version of it.
 """
 
 import os
+import sys
+import gc
 import copy
-import random
+import time
+import hashlib
+import tempfile
+import cPickle
+import cStringIO
 from lxml import etree
 
-from dg.dset import Dset
-from dg.util import p_
+from dg.dset import Dset, CompactDset
+from dg.util import p_, np_
 from dg.util import error, warning
 from dg.util import lstr
 from dg import _dtd_dir
 
 
-def from_file (dgfile, validate=True):
+def from_file (dgfile, validate=True, stream=False, cachedir=None,
+               lazy=False, jobs=1, index=False, compact=False):
     """
     Construct glossary from a Divergloss file.
 
     The glossary file may use XInclude to include subdocuments.
 
+    If streaming is requested, the glossary is constructed while the
+    document is being parsed, and each C{<concept>} element is discarded
+    as soon as its g-node has been constructed. This keeps the peak memory
+    close to the size of the glossary itself, but the validation is then
+    done piecewise; see L{from_stream} for details.
+
+    If a cache directory is given, the constructed glossary is stored
+    into it, and on later calls loaded from it instead of constructed anew,
+    as long as the document file, any of the included subdocuments,
+    and the DTD, all remain unchanged. A glossary constructed without
+    validation is not reused when validation is requested.
+
+    If lazy construction is requested, concepts are constructed only when
+    first accessed; see L{from_tree} for details.
+
+    If more than one job is requested, C{<concepts>} subdocuments included
+    directly into the C{<glossary>} element are parsed, validated and
+    constructed in that many parallel processes, once the key definitions
+    are constructed. Duplicate IDs are still detected across all of them.
+    This has no effect when streaming or constructing lazily.
+
+    If compact d-sets are requested, parts which differ by language
+    and environment are stored in L{CompactDset} instead of L{Dset}
+    objects, and texts are kept in their source form until first accessed,
+    which takes less memory.
+
+    If indexing is requested, the index of key users is created right
+    after the glossary has been constructed, rather than on first access
+    to L{Glossary.usages} or L{Glossary.backrefs}.
+
     @param dgfile: Divergloss file name
     @type dgfile: string
     @param validate: whether to validate the glossary
     @type validate: bool
+    @param stream: whether to construct the glossary while parsing
+    @type stream: bool
+    @param cachedir: directory for the cache of constructed glossaries
+    @type cachedir: string or C{None}
+    @param lazy: whether to construct concepts on first access
+    @type lazy: bool
+    @param jobs: number of processes constructing concept subdocuments
+    @type jobs: int
+    @param index: whether to create the index of key users
+    @type index: bool
+    @param compact: whether to use compact d-sets
+    @type compact: bool
 
     @return: constructed glossary
     @rtype: L{Gnode}
     """
 
+    gloss = None
+    if cachedir:
+        gloss = _cache_load(cachedir, dgfile, validate, compact)
+
+    if gloss is None:
+        # Files on which the glossary depends, recorded while constructing.
+        depfiles = []
+
+        if stream:
+            gloss = _from_stream(dgfile, validate, lazy, compact, depfiles)
+        elif jobs > 1 and not lazy:
+            gloss = _from_file_parallel(dgfile, validate, compact, jobs,
+                                        depfiles)
+        else:
+            gloss = _from_file_tree(dgfile, validate, lazy, compact,
+                                    depfiles)
+
+        # Record the state of files, to be able to update the glossary later.
+        gloss._depdigests = dict(_dep_digests(depfiles))
+
+        if cachedir:
+            _cache_store(cachedir, dgfile, validate, gloss)
+
+    if index:
+        _index_keys(gloss)
+
+    return gloss
+
+
+def _from_file_tree (dgfile, validate, lazy, compact, depfiles):
+
     try:
         # Do not validate at parse time, but afterwards.
         # Must resolve xincludes beforehand.
         parser = etree.XMLParser(dtd_validation=False, remove_comments=True)
+        parser.resolvers.add(_DepfileResolver(depfiles))
         tree = etree.parse(dgfile, parser=parser)
         tree.xinclude()
     except (etree.XMLSyntaxError, etree.XIncludeError), e:
-        errlins = "\n".join([str(x) for x in list(e.error_log)])
-        error(p_("error message",
-                 "XML parsing failed:\n"
-                 "%(msg)s") % {"msg":errlins})
+        _parse_error(e)
 
     if validate:
-        # Work around a bug: non-unique identifiers do not produce any
-        # message when validation fails.
-        ids = tree.xpath("//*/@id")
-        iddict = {}
-        for id in ids:
-            if id in iddict:
-                # Keep the message format same as below, just report ids.
-                error(p_("error message",
-                         "DTD validation failed:\n"
-                         "%(msg)s") % {"msg":p_("error message",
-                                                "duplicate ID '%(id)s'")
-                                             % {"id": id}})
-            iddict[id] = True
-
         # Resolve the DTD file and validate the tree according to it.
-        # FIXME: Better determination of dtd file (by public ID, etc.)
-        if tree.docinfo.system_url:
-            dtdname = tree.docinfo.system_url
-        else:
-            # Fallback to latest DTD.
-            dtdname = "divergloss.dtd"
-        dtdfile = os.path.join(_dtd_dir, dtdname)
-        dtd = etree.DTD(dtdfile)
+        # This also checks that identifiers are unique.
+        dtd = _load_dtd(tree.docinfo.system_url, depfiles)
         if not dtd.validate(tree):
-            errlins = "\n".join([str(x) for x in list(dtd.error_log)])
-            error(p_("error message",
-                     "DTD validation failed:\n"
-                     "%(msg)s") % {"msg":errlins})
+            # Work around a bug: non-unique identifiers do not produce
+            # any message when validation fails, with some libxml2 versions.
+            errs = list(dtd.error_log)
+            if not [x for x in errs if x.type_name == "DTD_ID_REDEFINED"]:
+                _check_unique_ids(tree.xpath("//*/@id"))
+            _dtd_error(errs)
 
     # Construct glossary from the document tree.
-    gloss = from_tree(tree, validate=validate)
+    gloss = from_tree(tree, validate=validate, lazy=lazy, compact=compact)
 
     return gloss
 
 
-def from_tree (tree, validate=True):
+def _from_file_parallel (dgfile, validate, compact, jobs, depfiles):
+
+    tree, subdocs = _parse_main_doc(dgfile, depfiles)
+    root = tree.getroot()
+
+    system_url = tree.docinfo.system_url
+    ids = []
+    if validate:
+        ids = tree.xpath("//*/@id")
+        _check_unique_ids(ids)
+
+        # Concepts may be referred to from other documents,
+        # so unknown IDs are checked after construction.
+        dtd = _load_dtd(system_url, depfiles)
+        if not dtd.validate(tree):
+            errs = [x for x in dtd.error_log
+                    if x.type_name != "DTD_UNKNOWN_ID"]
+            if errs:
+                _dtd_error(errs)
+
+    gloss = Glossary(root, compact=compact)
+
+    # Post-DTD validation of everything but concepts from subdocuments,
+    # leaving references to concepts to be checked after merging.
+    if validate:
+        valid, ckeys = _post_dtd_check_no_crefs(gloss, [gloss]
+                                                + gloss.concepts.values())
+
+    # Hand over the glossary to workers without any concepts,
+    # which they do not need.
+    concepts, registry = gloss.concepts, gloss._nodes_by_type
+    gloss.concepts, gloss._nodes_by_type = {}, {}
+    glosspickle = cPickle.dumps(gloss, cPickle.HIGHEST_PROTOCOL)
+    gloss.concepts, gloss._nodes_by_type = concepts, registry
+
+    # Also hand over the document without any concepts, for workers to
+    # validate subdocuments in place, with key definitions available.
+    skelxml = None
+    if validate:
+        skelxml = _skeleton_xml(root)
+
+    tasks = [(x, validate) for x in subdocs]
+    initargs = (glosspickle, skelxml, tree.docinfo.URL, system_url)
+    try:
+        import multiprocessing
+        # Each worker process exits after its subdocument,
+        # which makes collecting cyclic garbage in it pointless.
+        pool = multiprocessing.Pool(jobs, _worker_init, initargs, 1)
+        results = pool.map(_worker_construct, tasks)
+        pool.close()
+        pool.join()
+    except ImportError:
+        gcenabled = gc.isenabled()
+        _worker_init(*initargs)
+        results = map(_worker_construct, tasks)
+        if gcenabled:
+            gc.enable()
+
+    # Errors have already been reported by workers.
+    if None in results:
+        sys.exit(1)
+
+    # Identifiers must be unique across all subdocuments.
+    if validate:
+        for result in results:
+            ids.extend(result[1])
+        _check_unique_ids(ids)
+
+    # Unpickled concepts are all kept, so there is no garbage to collect
+    # meanwhile, and collecting would be slow with many new objects.
+    gcenabled = gc.isenabled()
+    gc.disable()
+    try:
+        for result in results:
+            cpickle, subids, subdepfiles, subvalid, subckeys = result
+            depfiles.extend(subdepfiles)
+            if validate:
+                valid = valid and subvalid
+                ckeys.update(subckeys)
+            concepts, subregistry, substats = _unpickle_in_gloss(cpickle,
+                                                                 gloss)
+            for concept in concepts:
+                gloss.concepts[concept.id] = concept
+            for cls, nodes in subregistry.iteritems():
+                registry.setdefault(cls, []).extend(nodes)
+            # Keys are shared within each subdocument by pickling,
+            # and need to be shared across them too.
+            _reintern(gloss, [x for y in subregistry.itervalues() for x in y])
+            gloss._intern_stats[0] += substats[0]
+            gloss._intern_stats[1] += substats[1]
+    finally:
+        if gcenabled:
+            gc.enable()
+
+    # If anything failed post-DTD validation in pieces,
+    # validate everything to report all errors.
+    if validate:
+        if not valid or [x for x in ckeys if x not in gloss.concepts]:
+            _post_dtd_validate(gloss)
+
+    return gloss
+
+
+# Check glossary nodes after DTD validation, without reporting errors,
+# and with references to concepts only collected and not checked.
+# Return whether the check passed and the set of referenced concept keys.
+def _post_dtd_check_no_crefs (gloss, gnodes):
+
+    concepts = gloss.concepts
+    gloss.concepts = _CollectedKeys()
+    errors = []
+    try:
+        for gnode in gnodes:
+            _post_dtd_in_node(gloss, gnode, errors)
+        ckeys = set(gloss.concepts)
+    finally:
+        gloss.concepts = concepts
+
+    return not errors, ckeys
+
+
+# Set which collects every key checked for membership, and contains it.
+class _CollectedKeys (set):
+
+    def __contains__ (self, key):
+
+        self.add(key)
+        return True
+
+
+# Parse the main document, leaving out concepts subdocuments included
+# directly into the glossary element, with empty concepts elements
+# in their place. Return the tree and paths of left out subdocuments.
+def _parse_main_doc (dgfile, depfiles):
+
+    try:
+        parser = etree.XMLParser(dtd_validation=False, remove_comments=True)
+        parser.resolvers.add(_DepfileResolver(depfiles))
+        tree = etree.parse(dgfile, parser=parser)
+
+        root = tree.getroot()
+        basedir = os.path.dirname(tree.docinfo.URL)
+        subdocs = []
+        for el in root.iterchildren(_xinclude_tag):
+            href = el.get("href")
+            if (   href is None or el.get("parse", "xml") != "xml"
+                or el.get("xpointer") is not None):
+                continue
+            incpath = os.path.join(basedir, href)
+            if _root_tag(incpath) == "concepts":
+                subdocs.append(incpath)
+                depfiles.append(incpath)
+                cn_el = etree.Element("concepts")
+                cn_el.tail = el.tail
+                root.replace(el, cn_el)
+
+        tree.xinclude()
+    except (etree.XMLSyntaxError, etree.XIncludeError), e:
+        _parse_error(e)
+
+    return tree, subdocs
+
+
+# Serialized document with metadata and key definitions of the main
+# document, and a single empty concepts element.
+def _skeleton_xml (root):
+
+    skel = etree.Element(root.tag, root.attrib, root.nsmap)
+    for el in root:
+        if el.tag in ("metadata", "keydefs"):
+            skel.append(copy.deepcopy(el))
+    skel.append(etree.Element("concepts"))
+
+    return etree.tostring(skel)
+
+
+# Parse a subdocument, resolving its own inclusions.
+def _parse_subdoc (fpath, depfiles):
+
+    try:
+        parser = etree.XMLParser(dtd_validation=False, remove_comments=True)
+        parser.resolvers.add(_DepfileResolver(depfiles))
+        tree = etree.parse(fpath, parser=parser)
+        tree.xinclude()
+    except (etree.XMLSyntaxError, etree.XIncludeError), e:
+        _parse_error(e)
+
+    return tree
+
+
+# Parse, validate and construct concepts of a concepts subdocument.
+# Return the concepts and all IDs in the subdocument.
+def _subdoc_concepts (gloss, fpath, validate, skelxml, url, system_url,
+                      depfiles):
+
+    tree = _parse_subdoc(fpath, depfiles)
+
+    cn_el = tree.getroot()
+    ids = []
+    if validate:
+        ids = tree.xpath("//*/@id")
+        # Validate in place of concepts in the glossary document,
+        # so that keys defined there are known.
+        skel = etree.fromstring(skelxml, base_url=url)
+        skel.replace(skel[-1], cn_el)
+        dtd = _load_dtd(system_url, depfiles)
+        if not dtd.validate(skel):
+            # Concepts in other subdocuments are not known.
+            errs = [x for x in dtd.error_log
+                    if x.type_name != "DTD_UNKNOWN_ID"]
+            if errs:
+                _dtd_error(errs)
+
+    concepts = []
+    for c_node in _child_els_by_tag(cn_el, "concept"):
+        concept = Concept(gloss, gloss, c_node)
+        _register(gloss, concept)
+        concepts.append(concept)
+
+    return concepts, list(ids)
+
+
+# Tag of the root element of the document, or None if cannot be parsed.
+def _root_tag (fpath):
+
+    try:
+        for event, el in etree.iterparse(fpath, events=("start",)):
+            return el.tag
+    except (IOError, etree.XMLSyntaxError):
+        pass
+
+    return None
+
+
+# Glossary and its document without concepts in a worker process,
+# and the document file and DTD location.
+_worker_gloss = None
+_worker_skelxml = None
+_worker_url = None
+_worker_system_url = None
+
+def _worker_init (glosspickle, skelxml, url, system_url):
+
+    global _worker_gloss, _worker_skelxml, _worker_url, _worker_system_url
+    gc.disable()
+    _worker_gloss = cPickle.loads(glosspickle)
+    _worker_skelxml = skelxml
+    _worker_url = url
+    _worker_system_url = system_url
+
+
+# Construct concepts from a subdocument in a worker process.
+# Return pickled concepts with their nodes by type and interning stats,
+# IDs in the subdocument, files loaded, whether the concepts passed
+# post-DTD checks and concept keys they refer to; or None if the subdocument
+# failed parsing or DTD validation.
+def _worker_construct (task):
+
+    fpath, validate = task
+    gloss = _worker_gloss
+    depfiles = []
+
+    try:
+        concepts, ids = _subdoc_concepts(gloss, fpath, validate,
+                                         _worker_skelxml, _worker_url,
+                                         _worker_system_url, depfiles)
+    except SystemExit:
+        # The error has been reported.
+        return None
+
+    valid, ckeys = True, set()
+    if validate:
+        valid, ckeys = _post_dtd_check_no_crefs(gloss, concepts)
+
+    registry, stats = gloss._nodes_by_type, gloss._intern_stats
+    gloss._nodes_by_type, gloss._intern_stats = {}, [0, 0]
+
+    return (_pickle_in_gloss((concepts, registry, stats), gloss), ids,
+            depfiles, valid, ckeys)
+
+
+# Pickle objects referencing the glossary without the glossary itself,
+# to be unpickled with references to another glossary.
+def _pickle_in_gloss (obj, gloss):
+
+    fh = cStringIO.StringIO()
+    pickler = cPickle.Pickler(fh, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = lambda x: x is gloss and "gloss" or None
+    pickler.dump(obj)
+
+    return fh.getvalue()
+
+
+def _unpickle_in_gloss (objpickle, gloss):
+
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(objpickle))
+    unpickler.persistent_load = lambda x: gloss
+
+    return unpickler.load()
+
+
+def from_stream (dgfile, validate=True, lazy=False, compact=False):
+    """
+    Construct glossary from a Divergloss file, while parsing it.
+
+    The document is parsed incrementally, and the glossary is built up
+    piece by piece: metadata and key definitions as their elements are
+    closed, and then each concept as its C{<concept>} element is closed.
+    Parsed elements are discarded right after their g-nodes have been
+    constructed, so that the full document tree is never held in memory.
+
+    XInclude is resolved on the fly for subdocuments included directly
+    into C{<glossary>} or C{<concepts>} elements, which are then streamed
+    too. Inclusions within metadata and key definitions are resolved
+    on their elements as usual.
+
+    Since there is no full document tree to validate against the DTD,
+    each streamed element is validated separately. Key references pointing
+    out of the element cannot be checked at that point, so they are left
+    to post-DTD validation, which checks all of them against the glossary.
+    Duplicate IDs are detected across the whole stream.
+
+    If lazy construction is requested, each concept element is kept
+    in serialized form, and parsed and constructed on first access.
+
+    @param dgfile: Divergloss file name
+    @type dgfile: string
+    @param validate: whether to validate the glossary
+    @type validate: bool
+    @param lazy: whether to construct concepts on first access
+    @type lazy: bool
+    @param compact: whether to use compact d-sets
+    @type compact: bool
+
+    @return: constructed glossary
+    @rtype: L{Gnode}
+    """
+
+    return _from_stream(dgfile, validate, lazy, compact, [])
+
+
+def _from_stream (dgfile, validate, lazy, compact, depfiles):
+
+    gloss = None
+    dtd = None
+    iddict = {}
+    try:
+        for el in _stream_elements(dgfile, depfiles):
+            if el.tag == "glossary":
+                # Only the root element attributes are available here.
+                gloss = Glossary(el, parts=False, lazy=lazy,
+                                 compact=compact)
+                if validate:
+                    system_url = el.getroottree().docinfo.system_url
+                    dtd = _load_dtd(system_url, depfiles)
+                continue
+
+            if gloss is None:
+                _dtd_error([p_("error message",
+                               "root element must be '%(tag)s'")
+                            % {"tag":"glossary"}])
+
+            if el.tag in ("metadata", "keydefs"):
+                basedir = os.path.dirname(el.base)
+                for href in el.xpath(".//xi:include/@href",
+                                     namespaces={"xi":_xinclude_ns}):
+                    depfiles.append(os.path.join(basedir, href))
+                etree.XInclude()(el)
+
+            if validate:
+                for id in el.xpath("descendant-or-self::*/@id"):
+                    if id in iddict:
+                        _duplicate_id_error(id)
+                    iddict[id] = True
+                # Validate a detached copy, not to have namespace
+                # declarations of the document propagated to the element.
+                if not dtd.validate(copy.deepcopy(el)):
+                    # Unknown IDs are checked after construction.
+                    errs = [x for x in dtd.error_log
+                            if x.type_name != "DTD_UNKNOWN_ID"]
+                    if errs:
+                        _dtd_error(errs)
+
+            if el.tag == "metadata":
+                gloss._add_metadata(el)
+            elif el.tag == "keydefs":
+                gloss._add_keydefs(el)
+            else:
+                gloss._add_concept(el)
+
+    except (etree.XMLSyntaxError, etree.XIncludeError), e:
+        _parse_error(e)
+
+    # Post-DTD validation.
+    if validate:
+        _post_dtd_validate(gloss)
+
+    return gloss
+
+
+_xinclude_ns = "http://www.w3.org/2001/XInclude"
+_xinclude_tag = "{%s}include" % _xinclude_ns
+
+# Yield the root glossary element when opened, and then metadata, keydefs,
+# and concept elements as they are closed, following into subdocuments
+# included into the glossary or concepts elements.
+# Yielded elements are cleared once the consumer is done with them.
+def _stream_elements (fpath, depfiles, included=False):
+
+    depfiles.append(fpath)
+    context = etree.iterparse(fpath, events=("start", "end"),
+                              remove_comments=True)
+    for event, el in context:
+        if event == "start":
+            if el.tag == "glossary" and el.getparent() is None:
+                yield el
+            continue
+
+        parent = el.getparent()
+        if parent is not None and parent.tag not in ("glossary", "concepts"):
+            continue
+
+        if el.tag == _xinclude_tag:
+            href = el.get("href")
+            if href is None or el.get("parse", "xml") != "xml":
+                error(p_("error message",
+                         "%(file)s:%(line)s: only plain XML inclusion "
+                         "by reference is supported when streaming")
+                      % {"file":fpath, "line":el.sourceline})
+            incpath = os.path.join(os.path.dirname(fpath), href)
+            if not os.path.isfile(incpath):
+                error(p_("error message",
+                         "%(file)s:%(line)s: cannot include '%(incfile)s'")
+                      % {"file":fpath, "line":el.sourceline,
+                         "incfile":incpath})
+            for incel in _stream_elements(incpath, depfiles, included=True):
+                yield incel
+        elif el.tag in ("metadata", "keydefs", "concept"):
+            yield el
+        else:
+            continue
+
+        # Discard processed element, and everything parsed before it.
+        el.clear()
+        if parent is not None:
+            while el.getprevious() is not None:
+                del parent[0]
+
+
+# Compiled DTDs by file path, with modification times of their files.
+_dtd_cache = {}
+
+def _load_dtd (system_url, depfiles):
+
+    # FIXME: Better determination of dtd file (by public ID, etc.)
+    if system_url:
+        dtdname = system_url
+    else:
+        # Fallback to latest DTD.
+        dtdname = "divergloss.dtd"
+    dtdfile = os.path.join(_dtd_dir, dtdname)
+    depfiles.append(dtdfile)
+
+    # Compile the DTD only if not done before, or if it was modified since.
+    mtime = os.path.getmtime(dtdfile)
+    dtd, cmtime = _dtd_cache.get(dtdfile, (None, None))
+    if dtd is None or cmtime != mtime:
+        dtd = etree.DTD(dtdfile)
+        _dtd_cache[dtdfile] = (dtd, mtime)
+
+    return dtd
+
+
+# Records paths of all files loaded by the parser, including subdocuments.
+class _DepfileResolver (etree.Resolver):
+
+    def __init__ (self, depfiles):
+
+        self._depfiles = depfiles
+
+
+    def resolve (self, url, pubid, context):
+
+        if url.startswith("file://"):
+            url = url[len("file://"):]
+        self._depfiles.append(url)
+        return None # let the default resolution proceed
+
+
+def _parse_error (e):
+
+    errlins = "\n".join([str(x) for x in list(e.error_log)])
+    error(p_("error message",
+             "XML parsing failed:\n"
+             "%(msg)s") % {"msg":errlins})
+
+
+def _dtd_error (error_log):
+
+    errlins = "\n".join([str(x) for x in list(error_log)])
+    error(p_("error message",
+             "DTD validation failed:\n"
+             "%(msg)s") % {"msg":errlins})
+
+
+def _check_unique_ids (ids):
+
+    # Look for the duplicate only if there is one.
+    if len(set(ids)) < len(ids):
+        seen = set()
+        for id in ids:
+            if id in seen:
+                _duplicate_id_error(id)
+            seen.add(id)
+
+
+def _duplicate_id_error (id):
+
+    # Keep the message format same as for DTD, just report ids.
+    _dtd_error([p_("error message", "duplicate ID '%(id)s'") % {"id": id}])
+
+
+def from_tree (tree, validate=True, lazy=False, compact=False):
     """
     Construct glossary from a Divergloss document tree.
 
+    If lazy construction is requested, the C{concepts} dictionary of
+    the glossary only references the concept elements in the tree at first,
+    and constructs each concept when it is accessed for the first time.
+    Lookup by key and iteration work as usual, and if the glossary
+    is validated, each concept is validated once it is constructed.
+    Note that the tree is then kept alive until all concepts are constructed.
+
     @param tree: Divergloss tree
     @type tree: etree from C{lxml.etree}
     @param validate: whether to validate the glossary
     @type validate: bool
+    @param lazy: whether to construct concepts on first access
+    @type lazy: bool
+    @param compact: whether to use compact d-sets
+    @type compact: bool
 
     @return: constructed glossary
     @rtype: L{Gnode}
     """
 
     root = tree.getroot()
-    gloss = Glossary(root)
+    gloss = Glossary(root, lazy=lazy, compact=compact)
 
     # Post-DTD validation.
     if validate:
@@ -229,106 +828,640 @@ def from_tree (tree, validate=True):
 
     return gloss
 
-# --------------------------------------
-# Validation.
 
-def _post_dtd_validate (gloss):
+def update (gloss, dgfile, validate=True):
+    """
+    Update glossary constructed from a Divergloss file, after the file
+    or some of its subdocuments have been modified.
+
+    Files on which the glossary depends are compared with their state at
+    construction, or at the previous update. If only C{<concepts>}
+    subdocuments included directly into the C{<glossary>} element have
+    been modified, only concepts from them are constructed anew, and when
+    validating, only those concepts which have been modified are validated,
+    together with concepts referring to removed ones. Otherwise, the whole
+    glossary is constructed anew, into the given glossary object.
+
+    If the glossary is constructed lazily, concepts from modified
+    subdocuments which have not been constructed yet cannot be compared
+    with their new versions, and are all reported as modified, whether
+    their content has changed or not. Concepts already constructed are
+    compared and reported only when really modified.
+
+    @param gloss: glossary constructed by L{from_file}
+    @type gloss: L{Gnode}
+    @param dgfile: Divergloss file name
+    @type dgfile: string
+    @param validate: whether to validate the glossary
+    @type validate: bool
 
-    _post_dtd_in_node(gloss, gloss)
+    @return: keys of concepts which have been added, removed or modified,
+        or C{None} if the whole glossary has been constructed anew
+    @rtype: set or C{None}
+    """
 
+    depdigests = getattr(gloss, "_depdigests", None)
+    if depdigests is None:
+        _reconstruct(gloss, dgfile, validate)
+        return None
+
+    modfiles = set([x for x, y in depdigests.items()
+                    if _file_digest(x) != y])
+    if not modfiles:
+        return set()
+
+    # Anything but concepts subdocuments modified requires full construction.
+    depfiles = []
+    tree, subdocs = _parse_main_doc(dgfile, depfiles)
+    subdocs = [os.path.abspath(x) for x in subdocs]
+    if not modfiles.issubset(subdocs):
+        _reconstruct(gloss, dgfile, validate)
+        return None
+
+    # Collect keys of concepts from unmodified documents,
+    # and all identifiers, to check them for uniqueness.
+    root = tree.getroot()
+    keptkeys = set(root.xpath("concepts/concept/@id"))
+    ids = []
+    if validate:
+        ids = tree.xpath("//*/@id")
+    for fpath in subdocs:
+        if fpath not in modfiles:
+            subtree = _parse_subdoc(fpath, [])
+            keptkeys.update(subtree.xpath("/concepts/concept/@id"))
+            if validate:
+                ids.extend(subtree.xpath("//*/@id"))
+
+    # Construct concepts from modified subdocuments.
+    skelxml = None
+    if validate:
+        skelxml = _skeleton_xml(root)
+    newconcepts = {}
+    for fpath in subdocs:
+        if fpath in modfiles:
+            concepts, subids = _subdoc_concepts(gloss, fpath, validate,
+                                                skelxml, tree.docinfo.URL,
+                                                tree.docinfo.system_url,
+                                                depfiles)
+            for concept in concepts:
+                newconcepts[concept.id] = concept
+            ids.extend(subids)
+    if validate:
+        _check_unique_ids(ids)
+
+    # Replace concepts from modified subdocuments,
+    # noting which of them are really modified.
+    oldkeys = set(gloss.concepts).difference(keptkeys)
+    oldconcepts = []
+    modkeys = set()
+    for ckey in oldkeys:
+        # Concepts not constructed yet, when constructing lazily,
+        # cannot be compared, so take them as modified.
+        oldconcept = dict.__getitem__(gloss.concepts, ckey)
+        if isinstance(oldconcept, Concept):
+            oldconcepts.append(oldconcept)
+        if (   ckey not in newconcepts or not isinstance(oldconcept, Concept)
+            or not _same_content(oldconcept, newconcepts[ckey])):
+            modkeys.add(ckey)
+        del gloss.concepts[ckey]
+    for ckey, concept in newconcepts.iteritems():
+        if ckey not in oldkeys:
+            modkeys.add(ckey)
+        gloss.concepts[ckey] = concept
+    remkeys = modkeys.difference(newconcepts)
+
+    _unregister(gloss, oldconcepts)
+
+    keyindex = gloss.__dict__.get("_key_index")
+    if keyindex is not None:
+        _reindex_keys(gloss, oldconcepts, newconcepts.values(), remkeys)
+
+    # Only references to removed concepts may have become invalid,
+    # among nodes which have not been modified.
+    if validate:
+        gnodes = [newconcepts[x] for x in modkeys if x in newconcepts]
+        if remkeys:
+            if keyindex is not None:
+                backrefs = keyindex["concepts"]
+            else:
+                backrefs = _key_users([gloss], ("concepts",))["concepts"]
+            for ckey in remkeys:
+                gnodes.extend(backrefs.get(ckey, []))
+        _post_dtd_validate_nodes(gloss, gnodes)
 
-def _post_dtd_in_node (gloss, gnode):
+    depdigests.update(_dep_digests(depfiles))
 
-    # Do checks.
-    _post_dtd_check_keys(gloss, gnode)
+    return modkeys
 
-    # Traverse further.
-    for att, obj in gnode.__dict__.iteritems():
-        if att == "parent":
+
+def intern_stats (gloss):
+    """
+    Report how much memory was saved by sharing keys in attributes.
+
+    Attributes stating keys (C{lang}, C{env}, C{by}, C{src}, C{gr},
+    C{topic}, C{level}, etc.) share a single object for each key,
+    starting with keys defined in the glossary, and environment lists
+    and other lists of keys share a single tuple for equal lists.
+    Savings are counted while constructing, and are kept in the cache.
+
+    @param gloss: constructed glossary
+    @type gloss: L{Glossary}
+
+    @return: number of distinct shared values, number of duplicates
+        replaced by a shared value, and bytes taken by those duplicates
+    @rtype: (int, int, int)
+    """
+
+    return ((len(gloss._interned),) + tuple(gloss._intern_stats))
+
+
+def register_nodes (gloss, gnodes):
+    """
+    Record nodes added to the glossary after its construction.
+
+    The nodes and all their descendants are added to the registry
+    in L{Glossary.nodes_by_type}, after the nodes already in it.
+    They must not be in the registry already, i.e. a node which is
+    moved within the glossary must not be registered again.
+
+    @param gloss: constructed glossary
+    @type gloss: L{Glossary}
+    @param gnodes: nodes which have been added
+    @type gnodes: sequence of L{Gnode}
+    """
+
+    # Nodes in d-sets are reached once per their environment.
+    seen = set()
+    stack = list(reversed(gnodes))
+    while stack:
+        gnode = stack.pop()
+        if id(gnode) in seen:
             continue
-        if isinstance(obj, Text):
-            _post_dtd_in_text(gloss, obj)
-        else:
-            subns = []
-            if isinstance(obj, Gnode):
-                subns = [obj]
-            elif isinstance(obj, Dset):
-                subns = obj.values() # all in Dset are Gnode
-            elif isinstance(obj, dict):
-                subns = [x for x in obj.values() if isinstance(x, Gnode)]
-            elif isinstance(obj, list):
-                subns = [x for x in obj if isinstance(x, Gnode)]
+        seen.add(id(gnode))
+        _register(gloss, gnode)
+        stack.extend(reversed(_gnode_parts(gnode)[1]))
 
-            for subn in subns:
-                _post_dtd_in_node(gloss, subn)
 
+def unregister_nodes (gloss, gnodes):
+    """
+    Forget nodes removed from the glossary after its construction.
 
-def _post_dtd_in_text (gloss, text):
+    The nodes and all their descendants are removed from the registry
+    in L{Glossary.nodes_by_type}.
 
-    # Do checks.
-    _post_dtd_check_keys(gloss, text)
+    @param gloss: constructed glossary
+    @type gloss: L{Glossary}
+    @param gnodes: nodes which have been removed
+    @type gnodes: sequence of L{Gnode}
+    """
+
+    _unregister(gloss, gnodes)
+
+
+# Construct the glossary anew from the file, into the given glossary object.
+def _reconstruct (gloss, dgfile, validate):
+
+    lazy = isinstance(getattr(gloss, "concepts", None), _LazyConcepts)
+    index = "_key_index" in gloss.__dict__
+    compact = gloss._dset_type is CompactDset
+    ngloss = from_file(dgfile, validate=validate, lazy=lazy, compact=compact)
+
+    gloss.__dict__.clear()
+    gloss.__dict__.update(ngloss.__dict__)
+    gloss.src_line = ngloss.src_line
+    _replace_gloss(gloss, ngloss, gloss)
+    if index:
+        _index_keys(gloss)
+
+
+# Replace references to one glossary object with another in a subtree.
+def _replace_gloss (gnode, ogloss, gloss):
+
+    for att, obj in _gnode_items(gnode):
+        if att == "parent" or att.startswith("_"):
+            continue
+        subns = []
+        if isinstance(obj, Gnode):
+            subns = [obj]
+        elif isinstance(obj, Dset):
+            obj.gloss = gloss
+            if obj.parent is ogloss:
+                obj.parent = gloss
+            subns = obj.values()
+        elif isinstance(obj, _LazyConcepts):
+            obj._gloss = gloss
+            subns = obj._constructed_values()
+        elif isinstance(obj, dict):
+            subns = [x for x in obj.values() if isinstance(x, Gnode)]
+        elif isinstance(obj, list):
+            subns = [x for x in obj if isinstance(x, Gnode)]
+
+        for subn in subns:
+            if subn.parent is ogloss:
+                subn.parent = gloss
+            _replace_gloss(subn, ogloss, gloss)
+
+
+# Whether two constructed objects have the same content,
+# disregarding their position in the glossary and in the document.
+def _same_content (obj1, obj2):
+
+    if isinstance(obj1, _TextSource):
+        obj1 = obj1.parse(0)
+    if isinstance(obj2, _TextSource):
+        obj2 = obj2.parse(0)
+
+    if type(obj1) is not type(obj2):
+        return False
+
+    if isinstance(obj1, Gnode):
+        items1 = [x for x in _gnode_items(obj1)
+                  if x[0] not in ("parent", "src_line")]
+        items2 = [x for x in _gnode_items(obj2)
+                  if x[0] not in ("parent", "src_line")]
+        return _same_content(dict(items1), dict(items2))
+    elif isinstance(obj1, CompactDset):
+        return (    obj1.__getstate__()[3:] == obj2.__getstate__()[3:]
+                and _same_content(obj1._objs, obj2._objs))
+    elif isinstance(obj1, Dset):
+        return _same_content(obj1._data, obj2._data)
+    elif isinstance(obj1, dict):
+        if set(obj1) != set(obj2):
+            return False
+        for key in obj1:
+            if not _same_content(obj1[key], obj2[key]):
+                return False
+        return True
+    elif isinstance(obj1, (list, tuple)):
+        if len(obj1) != len(obj2):
+            return False
+        if isinstance(obj1, Text):
+            for attname in _text_attnames(type(obj1)):
+                if (    attname != "src_line"
+                    and getattr(obj1, attname, None)
+                        != getattr(obj2, attname, None)):
+                    return False
+        for el1, el2 in zip(obj1, obj2):
+            if not _same_content(el1, el2):
+                return False
+        return True
+    else:
+        return obj1 == obj2
+
+
+# --------------------------------------
+# Cache of constructed glossaries.
+
+# Increase whenever the internal glossary structure changes,
+# to have all existing cache files discarded.
+_cache_version = 9
+_cache_magic = "divergloss-cache"
+
+
+def _cache_path (cachedir, dgfile):
+
+    fname = hashlib.sha1(os.path.abspath(dgfile)).hexdigest() + ".dgc"
+    return os.path.join(cachedir, fname)
+
+
+def _file_digest (fpath):
+
+    try:
+        ifl = open(fpath, "rb")
+        digest = hashlib.sha1(ifl.read()).hexdigest()
+        ifl.close()
+    except IOError:
+        digest = None
+    return digest
+
+
+# Absolute paths of given files with their digests, each file once.
+def _dep_digests (depfiles):
+
+    depdigests = []
+    seen = set()
+    for fpath in depfiles:
+        fpath = os.path.abspath(fpath)
+        if fpath not in seen:
+            seen.add(fpath)
+            depdigests.append((fpath, _file_digest(fpath)))
+
+    return depdigests
+
+
+# The cache file contains two pickles: the header, with the format version
+# and digests of all files the glossary depends on, and the glossary itself.
+# This way the glossary is unpickled only if the header matches.
+def _cache_load (cachedir, dgfile, validate, compact):
+
+    cpath = _cache_path(cachedir, dgfile)
+    if not os.path.isfile(cpath):
+        return None
+
+    try:
+        ifl = open(cpath, "rb")
+        try:
+            magic, version, validated, compacted, depdigests = \
+                cPickle.load(ifl)
+            if magic != _cache_magic or version != _cache_version:
+                return None
+            if validate and not validated:
+                return None
+            if compact != compacted:
+                return None
+            for fpath, digest in depdigests:
+                if _file_digest(fpath) != digest:
+                    return None
+            gloss = cPickle.load(ifl)
+        finally:
+            ifl.close()
+    except Exception:
+        # Treat any damage to the cache file as a miss.
+        return None
+
+    return gloss
+
+
+def _cache_store (cachedir, dgfile, validate, gloss):
+
+    depdigests = gloss._depdigests.items()
+    compact = gloss._dset_type is CompactDset
+    header = (_cache_magic, _cache_version, validate, compact, depdigests)
+
+    # Write to a temporary file and then rename it, so that concurrent
+    # runs never see a partially written cache file.
+    # The glossary is already constructed, so failing to cache it
+    # is only reported, and any temporary file removed.
+    tmppath = None
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        fd, tmppath = tempfile.mkstemp(dir=cachedir)
+        ofl = os.fdopen(fd, "wb")
+        try:
+            cPickle.dump(header, ofl, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(gloss, ofl, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            ofl.close()
+        os.rename(tmppath, _cache_path(cachedir, dgfile))
+    except Exception, e:
+        if tmppath is not None and os.path.isfile(tmppath):
+            os.unlink(tmppath)
+        warning(p_("warning message",
+                   "cannot store the glossary into cache "
+                   "directory '%(dir)s': %(msg)s")
+                % dict(dir=cachedir, msg=e))
+
+
+# --------------------------------------
+# Index of key users.
+
+# Glossary dictionaries whose keys are indexed by the nodes using them.
+_indexed_key_dicts = ("concepts", "editors", "sources", "topics", "levels",
+                      "extroots")
+
+# Create the index of key users for the whole glossary.
+# All concepts are constructed, if constructing lazily.
+def _index_keys (gloss):
+
+    gloss.concepts.values()
+    index = _key_users([gloss], _indexed_key_dicts)
+    for keydictname in _indexed_key_dicts:
+        for key in getattr(gloss, keydictname):
+            index[keydictname].setdefault(key, [])
+    gloss._key_index = index
+
+
+# Update the index of key users when some concepts have been replaced.
+def _reindex_keys (gloss, oldconcepts, newconcepts, remkeys):
+
+    index = gloss._key_index
+
+    rindex = _key_users(oldconcepts, _indexed_key_dicts)
+    for keydictname, rusers in rindex.iteritems():
+        users = index[keydictname]
+        for key, rgnodes in rusers.iteritems():
+            rids = set([id(x) for x in rgnodes])
+            users[key] = [x for x in users.get(key, []) if id(x) not in rids]
+
+    aindex = _key_users(newconcepts, _indexed_key_dicts)
+    for keydictname, ausers in aindex.iteritems():
+        users = index[keydictname]
+        for key, agnodes in ausers.iteritems():
+            users.setdefault(key, []).extend(agnodes)
+
+    cusers = index["concepts"]
+    for concept in newconcepts:
+        cusers.setdefault(concept.id, [])
+    for ckey in remkeys:
+        if not cusers.get(ckey):
+            cusers.pop(ckey, None)
+
+
+# Collect nodes using keys from given glossary dictionaries,
+# in given subtrees, as dictionary of dictionaries by key.
+# Nodes using keys in their texts are taken as users too.
+def _key_users (gnodes, keydictnames):
+
+    index = dict([(x, {}) for x in keydictnames])
+    for gnode in gnodes:
+        _key_users_in_node(gnode, index)
+
+    return index
+
+
+def _key_users_in_node (gnode, index):
+
+    _key_users_add(gnode, gnode, index)
+
+    texts, subns = _gnode_parts(gnode)
+    for text in texts:
+        _key_users_in_text(gnode, text, index)
+    for subn in subns:
+        _key_users_in_node(subn, index)
+
+
+def _key_users_in_text (gnode, text, index):
+
+    _key_users_add(gnode, text, index)
 
-    # Traverse further.
     for seg in text:
         if isinstance(seg, Text):
-            _post_dtd_in_text(gloss, seg)
+            _key_users_in_text(gnode, seg, index)
+
+
+def _key_users_add (gnode, obj, index):
 
+    for attname, keydictname, isseq, msg in \
+            _post_dtd_type_key_atts(obj.__class__):
+        users = index.get(keydictname)
+        if users is None:
+            continue
+        keys = getattr(obj, attname, None)
+        if not isseq:
+            keys = [keys]
+        for key in keys or []:
+            if key is None:
+                continue
+            gnodes = users.get(key)
+            if gnodes is None:
+                users[key] = [gnode]
+            elif gnodes[-1] is not gnode:
+                gnodes.append(gnode)
+
+
+# --------------------------------------
+# Validation.
+
+def _post_dtd_validate (gloss):
 
-def _post_dtd_check_keys (gloss, gnode):
+    _post_dtd_validate_nodes(gloss, [gloss])
 
-    _post_dtd_ch_key(gloss, gnode, "lang", gloss.languages,
-        p_("error message",
-           "attribute '%(att)s' states a non-language key: %(key)s"))
+    # Concepts not constructed yet are validated when they are.
+    if isinstance(gloss.concepts, _LazyConcepts):
+        gloss.concepts._validate = True
 
-    _post_dtd_ch_keyseq(gloss, gnode, "env", gloss.environments,
-        p_("error message",
-           "attribute '%(att)s' states non-environment keys: %(keys)s"))
 
-    _post_dtd_ch_key(gloss, gnode, "by", gloss.editors,
-        p_("error message",
-           "attribute '%(att)s' states a non-editor key: %(key)s"))
+def _post_dtd_validate_nodes (gloss, gnodes):
 
-    _post_dtd_ch_key(gloss, gnode, "src", gloss.sources,
-        p_("error message",
-           "attribute '%(att)s' states a non-source key: %(key)s"))
+    # All errors in the subtrees are collected first, to report them together.
+    errors = []
+    time0 = time.time()
+    for gnode in gnodes:
+        _post_dtd_in_node(gloss, gnode, errors)
+    # Versions of a node resolved from embedded selectors share the
+    # same source, so the same error may be found several times.
+    errors = _unique(errors)
+    if errors:
+        error(np_("error message",
+                  "post-DTD validation failed, %(num)d error found "
+                  "in %(time).2f sec:\n"
+                  "%(msgs)s",
+                  "post-DTD validation failed, %(num)d errors found "
+                  "in %(time).2f sec:\n"
+                  "%(msgs)s",
+                  len(errors))
+              % {"num":len(errors), "time":(time.time() - time0),
+                 "msgs":"\n".join(errors)})
 
-    _post_dtd_ch_key(gloss, gnode, "gr", gloss.grammar,
-        p_("error message",
-           "attribute '%(att)s' states a non-grammar key: %(key)s"))
 
-    _post_dtd_ch_key(gloss, gnode, "root", gloss.extroots,
-        p_("error message",
-           "attribute '%(att)s' states a non-root key: %(key)s"))
+def _unique (lst):
 
-    _post_dtd_ch_key(gloss, gnode, "c", gloss.concepts,
-        p_("error message",
-           "attribute '%(att)s' states a non-concept key: %(key)s"))
+    seen = set()
+    ulst = []
+    for x in lst:
+        if x not in seen:
+            seen.add(x)
+            ulst.append(x)
 
-    _post_dtd_ch_keyseq(gloss, gnode, "closeto", gloss.environments,
-        p_("error message",
-           "attribute '%(att)s' states non-environment keys: %(keys)s"))
+    return ulst
+
+
+def _post_dtd_in_node (gloss, gnode, errors):
+
+    # Do checks.
+    _post_dtd_check_keys(gloss, gnode, errors)
+
+    # Traverse further.
+    texts, subns = _gnode_parts(gnode)
+    for text in texts:
+        _post_dtd_in_text(gloss, text, errors)
+    for subn in subns:
+        _post_dtd_in_node(gloss, subn, errors)
 
-    _post_dtd_ch_keyseq(gloss, gnode, "topic", gloss.topics,
-        p_("error message",
-           "attribute '%(att)s' states non-topic keys: %(keys)s"))
 
-    _post_dtd_ch_keyseq(gloss, gnode, "level", gloss.levels,
-        p_("error message",
-           "attribute '%(att)s' states non-level keys: %(keys)s"))
+def _post_dtd_in_text (gloss, text, errors):
 
-    _post_dtd_ch_keyseq(gloss, gnode, "related", gloss.concepts,
-        p_("error message",
-           "attribute '%(att)s' states non-concept keys: %(keys)s"))
+    # Do checks.
+    _post_dtd_check_keys(gloss, text, errors)
+
+    # Traverse further.
+    for seg in text:
+        if isinstance(seg, Text):
+            _post_dtd_in_text(gloss, seg, errors)
+
+
+# Attributes which must state defined keys, as tuples of:
+# attribute name, glossary attribute with the key dictionary,
+# whether the value is a sequence of keys, and the error message.
+_post_dtd_key_atts = (
+    ("lang", "languages", False,
+     p_("error message",
+        "attribute '%(att)s' states a non-language key: %(key)s")),
+    ("env", "environments", True,
+     p_("error message",
+        "attribute '%(att)s' states non-environment keys: %(keys)s")),
+    ("by", "editors", False,
+     p_("error message",
+        "attribute '%(att)s' states a non-editor key: %(key)s")),
+    ("src", "sources", False,
+     p_("error message",
+        "attribute '%(att)s' states a non-source key: %(key)s")),
+    ("gr", "grammar", False,
+     p_("error message",
+        "attribute '%(att)s' states a non-grammar key: %(key)s")),
+    ("root", "extroots", False,
+     p_("error message",
+        "attribute '%(att)s' states a non-root key: %(key)s")),
+    ("c", "concepts", False,
+     p_("error message",
+        "attribute '%(att)s' states a non-concept key: %(key)s")),
+    ("closeto", "environments", True,
+     p_("error message",
+        "attribute '%(att)s' states non-environment keys: %(keys)s")),
+    ("topic", "topics", True,
+     p_("error message",
+        "attribute '%(att)s' states non-topic keys: %(keys)s")),
+    ("level", "levels", True,
+     p_("error message",
+        "attribute '%(att)s' states non-level keys: %(keys)s")),
+    ("related", "concepts", True,
+     p_("error message",
+        "attribute '%(att)s' states non-concept keys: %(keys)s")),
+)
+
+_post_dtd_key_atts_by_type = {}
+
+# Key attributes which objects of the given type can have,
+# determined from their slots.
+def _post_dtd_type_key_atts (cls):
+
+    keyatts = _post_dtd_key_atts_by_type.get(cls)
+    if keyatts is None:
+        if cls.__dictoffset__:
+            # Objects with a dictionary can have any attribute.
+            keyatts = _post_dtd_key_atts
+        else:
+            if issubclass(cls, Text):
+                attnames = _text_attnames(cls)
+            else:
+                attnames = cls._attnames
+            keyatts = tuple([x for x in _post_dtd_key_atts
+                             if x[0] in attnames])
+        _post_dtd_key_atts_by_type[cls] = keyatts
+
+    return keyatts
+
+
+def _post_dtd_check_keys (gloss, gnode, errors):
+
+    for keyatt in _post_dtd_type_key_atts(gnode.__class__):
+        attname, keydictname, isseq, msg = keyatt
+        keydict = getattr(gloss, keydictname)
+        if isseq:
+            _post_dtd_ch_keyseq(gnode, attname, keydict, msg, errors)
+        else:
+            _post_dtd_ch_key(gnode, attname, keydict, msg, errors)
 
 
-def _post_dtd_ch_key (gloss, gnode, attname, keydict, msg):
+def _post_dtd_ch_key (gnode, attname, keydict, msg, errors):
 
     key = getattr(gnode, attname, None)
     if key is not None and key not in keydict:
-        _post_dtd_error(gloss, gnode, msg % {"att":attname, "key":key})
+        _post_dtd_error(gnode, msg % {"att":attname, "key":key}, errors)
 
 
-def _post_dtd_ch_keyseq (gloss, gnode, attname, keydict, msg):
+def _post_dtd_ch_keyseq (gnode, attname, keydict, msg, errors):
 
     keys = getattr(gnode, attname, [])
     if keys is None:
@@ -336,18 +1469,15 @@ def _post_dtd_ch_keyseq (gloss, gnode, attname, keydict, msg):
     badkeys = [x for x in keys if x not in keydict and x is not None]
     if badkeys:
         fmtk = " ".join(badkeys)
-        _post_dtd_error(gloss, gnode, msg % {"att":attname, "keys":fmtk})
+        _post_dtd_error(gnode, msg % {"att":attname, "keys":fmtk}, errors)
 
 
-def _post_dtd_error (gloss, gnode, msg):
+def _post_dtd_error (gnode, msg, errors):
 
     lmsg = p_("message with the location it speaks of",
               "%(file)s:%(line)s: %(msg)s") \
            % {"file":gnode.src_file, "line":gnode.src_line, "msg":msg,}
-
-    error(p_("error message",
-             "post-DTD validation failed:\n"
-             "%(msg)s") % {"msg":lmsg})
+    errors.append(lmsg)
 
 
 # --------------------------------------
@@ -422,6 +1552,23 @@ def _content (obj, gloss, node, parse_bundles):
         consf(obj, gloss, node, *args)
 
 
+# Placeholder in content specifications for a default value
+# to be taken from the same-named attribute of the glossary.
+class _GlossDefault (object):
+
+    def __init__ (self, attname):
+
+        self.attname = attname
+
+
+_gloss_lang = _GlossDefault("lang")
+_gloss_env = _GlossDefault("env")
+
+# Shared default for list attributes not given in the node.
+# Attribute lists are not modified after construction, so it is immutable.
+_empty_attrib_list = ()
+
+
 def _attributes (obj, gloss, node, attspecs):
 
     for attspec in attspecs:
@@ -429,11 +1576,15 @@ def _attributes (obj, gloss, node, attspecs):
             attname, defval = attspec
         else:
             attname, defval = attspec, None
+        if isinstance(defval, _GlossDefault):
+            defval = getattr(gloss, defval.attname)
         if node is not None:
             val = _attval(node, attname, defval)
+            if val is not defval and attname in _key_attnames:
+                val = _intern(gloss, val)
         else:
             val = defval
-        obj.__dict__[attname] = val
+        setattr(obj, attname, val)
 
 
 def _attrib_lists (obj, gloss, node, attspecs):
@@ -442,14 +1593,92 @@ def _attrib_lists (obj, gloss, node, attspecs):
         if isinstance(attspec, tuple):
             attname, deflst = attspec
         else:
-            attname, deflst = attspec, []
+            attname, deflst = attspec, _empty_attrib_list
+        if isinstance(deflst, _GlossDefault):
+            deflst = getattr(gloss, deflst.attname)
         if node is not None:
             val = _attval(node, attname, deflst)
         else:
             val = deflst
         if isinstance(val, (str, unicode)):
-            val = val.split()
-        obj.__dict__[attname] = val
+            if attname in _key_attnames:
+                val = _intern_keys(gloss, val.split())
+            else:
+                val = tuple(val.split())
+        setattr(obj, attname, val)
+
+
+# Names of attributes stating keys, whose values are interned.
+_key_attnames = frozenset([x[0] for x in _post_dtd_key_atts])
+
+# Get the single shared object equal to the given key, or tuple of keys,
+# recording the size of the given object when it is a duplicate.
+# Keys defined in the glossary are taken first, see Glossary._add_keydefs.
+def _intern (gloss, val):
+
+    ival = gloss._interned.setdefault(val, val)
+    if ival is not val:
+        gloss._intern_stats[0] += 1
+        gloss._intern_stats[1] += sys.getsizeof(val)
+
+    return ival
+
+
+# Interned tuple of interned keys.
+def _intern_keys (gloss, keys):
+
+    return _intern(gloss, tuple([_intern(gloss, x) for x in keys]))
+
+
+# Intern key attributes of nodes constructed elsewhere,
+# e.g. in another process, where values are already shared among the nodes.
+def _reintern (gloss, gnodes):
+
+    ivals = {}
+    for gnode in gnodes:
+        for attname, keydictname, isseq, msg in \
+                _post_dtd_type_key_atts(gnode.__class__):
+            val = getattr(gnode, attname, None)
+            if not isinstance(val, (basestring, tuple)):
+                continue
+            ival = ivals.get(id(val))
+            if ival is None:
+                if isseq and val not in gloss._interned:
+                    ival = _intern_keys(gloss, val)
+                else:
+                    ival = _intern(gloss, val)
+                ivals[id(val)] = ival
+            setattr(gnode, attname, ival)
+
+
+# Record a newly constructed node into the registry of nodes by type.
+def _register (gloss, gnode):
+
+    nodes = gloss._nodes_by_type.get(gnode.__class__)
+    if nodes is None:
+        gloss._nodes_by_type[gnode.__class__] = [gnode]
+    else:
+        nodes.append(gnode)
+
+
+# Remove given nodes and all their descendants from the registry.
+def _unregister (gloss, gnodes):
+
+    if not gnodes:
+        return
+
+    rids = set()
+    stack = list(gnodes)
+    while stack:
+        gnode = stack.pop()
+        if id(gnode) in rids:
+            continue
+        rids.add(id(gnode))
+        stack.extend(_gnode_parts(gnode)[1])
+
+    registry = gloss._nodes_by_type
+    for cls, nodes in registry.items():
+        registry[cls] = [x for x in nodes if id(x) not in rids]
 
 
 def _child_dsets (obj, gloss, node, chdspecs):
@@ -460,14 +1689,16 @@ def _child_dsets (obj, gloss, node, chdspecs):
         else:
             attname, subtype = chdspec
             tagnames = (attname,)
-        if attname not in obj.__dict__:
-            obj.__dict__[attname] = Dset(gloss, obj)
-        dst = obj.__dict__[attname]
+        dst = getattr(obj, attname, None)
+        if dst is None:
+            dst = gloss._dset_type(gloss, obj)
+            setattr(obj, attname, dst)
         if node is not None:
             for cnode in _child_els_by_tag(node, tagnames):
                 subobj = subtype(gloss, obj, cnode)
                 # Add several resolved objects if any embedded selections.
                 for rsubobj in _res_embsel(gloss, subobj):
+                    _register(gloss, rsubobj)
                     dst.add(rsubobj)
 
 
@@ -479,23 +1710,28 @@ def _child_lists (obj, gloss, node, chlspecs):
         else:
             attname, subtype = chlspec
             tagnames = (attname,)
-        if attname not in obj.__dict__:
-            obj.__dict__[attname] = []
-        lst = obj.__dict__[attname]
+        lst = getattr(obj, attname, None)
+        if lst is None:
+            lst = []
+            setattr(obj, attname, lst)
         if node is not None:
             for cnode in _child_els_by_tag(node, tagnames):
-                lst.append(subtype(gloss, obj, cnode))
+                o = subtype(gloss, obj, cnode)
+                _register(gloss, o)
+                lst.append(o)
 
 
 def _child_dicts (obj, gloss, node, chmspecs):
 
     for dictname, subtype, tagname in chmspecs:
-        if dictname not in obj.__dict__:
-            obj.__dict__[dictname] = {}
-        dct = obj.__dict__[dictname]
+        dct = getattr(obj, dictname, None)
+        if dct is None:
+            dct = {}
+            setattr(obj, dictname, dct)
         if node is not None:
             for cnode in _child_els_by_tag(node, tagname):
                 o = subtype(gloss, obj, cnode)
+                _register(gloss, o)
                 dct[o.id] = o
 
 
@@ -509,32 +1745,159 @@ def _children (obj, gloss, node, chspecs):
             tagnames = (attname,)
         if node is not None:
             for cnode in _child_els_by_tag(node, tagnames):
-                obj.__dict__[attname] = subtype(gloss, obj, cnode)
+                o = subtype(gloss, obj, cnode)
+                _register(gloss, o)
+                setattr(obj, attname, o)
                 break # a single node expected, so take first
         else:
-            obj.__dict__[attname] = None
+            setattr(obj, attname, None)
 
 
 def _text (obj, gloss, node):
 
-    obj.text = Text(node)
+    if node is not None and gloss._text_sources:
+        obj.text = _TextSource(etree.tostring(node, encoding="UTF-8",
+                                              with_tail=False))
+    else:
+        obj.text = Text(node)
 
 
 # --------------------------------------
 # Self-constructing glossary from XML nodes.
 
+# Names of data attributes produced by a content specification.
+def _spec_attnames (spec):
+
+    attnames = []
+    for consf, args in spec:
+        if consf is _text:
+            attnames.append("text")
+            continue
+        for subspec in args[0]:
+            if isinstance(subspec, (str, unicode)):
+                attnames.append(subspec)
+            else:
+                attnames.append(subspec[0])
+
+    return attnames
+
+
+# Type of glossary node classes.
+# Unless the class states its own slots, it is given slots for exactly
+# the attributes produced by its content specification (the _spec class
+# attribute), so that instances do not carry a dictionary each.
+# Text is kept in the _text slot, behind the text property,
+# since it may be kept in source form until first accessed.
+class _GnodeType (type):
+
+    def __new__ (mcls, name, bases, dct):
+
+        if "__slots__" not in dct:
+            baseattnames = set()
+            for base in bases:
+                baseattnames.update(getattr(base, "_attnames", ()))
+            attnames = [x != "text" and x or "_text"
+                        for x in _spec_attnames(dct.get("_spec", []))]
+            dct["__slots__"] = tuple([x for x in attnames
+                                      if x not in baseattnames])
+            if "_text" in dct["__slots__"]:
+                dct["text"] = property(_gnode_get_text, _gnode_set_text)
+
+        cls = type.__new__(mcls, name, bases, dct)
+
+        # Collect names of all slots, including those of base classes.
+        attnames = []
+        for scls in reversed(cls.__mro__):
+            for attname in scls.__dict__.get("__slots__", ()):
+                if attname != "__dict__" and attname not in attnames:
+                    attnames.append(attname)
+        cls._attnames = tuple(attnames)
+
+        return cls
+
+
+# Text of a glossary node, parsed on first access if in source form.
+def _gnode_get_text (gnode):
+
+    text = gnode._text
+    if isinstance(text, _TextSource):
+        text = text.parse(gnode.src_line)
+        gnode._text = text
+    return text
+
+
+def _gnode_set_text (gnode, text):
+
+    gnode._text = text
+
+
+# Get texts and child nodes of a glossary node, as two lists.
+# Only concepts already constructed are taken, if constructing lazily.
+# Texts in source form are parsed for the occasion, and left as they are;
+# those without inner elements are left out, as they have no attributes.
+def _gnode_parts (gnode):
+
+    texts = []
+    subns = []
+    for att, obj in _gnode_items(gnode):
+        if obj is None or att == "parent" or att.startswith("_"):
+            continue
+        if isinstance(obj, basestring):
+            if type(obj) is _TextSource and obj.count("<") > 2:
+                texts.append(obj.parse(gnode.src_line))
+            continue
+        if isinstance(obj, Text):
+            texts.append(obj)
+        elif isinstance(obj, Gnode):
+            subns.append(obj)
+        elif isinstance(obj, Dset):
+            subns.extend(obj.values()) # all in Dset are Gnode
+        elif isinstance(obj, _LazyConcepts):
+            subns.extend(obj._constructed_values())
+        elif isinstance(obj, dict):
+            subns.extend([x for x in obj.itervalues() if isinstance(x, Gnode)])
+        elif isinstance(obj, (list, tuple)):
+            # Lists hold either only nodes or only keys.
+            if obj and isinstance(obj[0], Gnode):
+                subns.extend(obj)
+
+    return texts, subns
+
+
+# Get all data attributes of a glossary node as (name, value) pairs,
+# whether they are kept in slots or in the instance dictionary.
+# Text is given as kept, which may be in source form.
+def _gnode_items (gnode):
+
+    items = []
+    for attname in gnode._attnames:
+        val = getattr(gnode, attname, _gnode_items)
+        if val is not _gnode_items:
+            if attname == "_text":
+                attname = "text"
+            items.append((attname, val))
+    items.extend(getattr(gnode, "__dict__", {}).items())
+
+    return items
+
+
 # Base of glossary nodes.
-class Gnode:
+class Gnode (object):
+
+    __metaclass__ = _GnodeType
+
+    __slots__ = ("parent", "src_line")
+
+    # Source file is not tracked yet, so it is same for all nodes.
+    src_file = p_("an unknown file", "<unknown>")
 
     def __init__ (self, parent, node=None):
 
         self.parent = parent
 
         self.src_line = 0
-        self.src_file = p_("an unknown file", "<unknown>")
         if node is not None:
             self.src_line = node.sourceline
-            # self.src_file = ?
 
 
 # Glossary.
@@ -550,18 +1913,18 @@ class Glossary (Gnode):
 
         concepts (dict)
             id (string)
-            topic (list of strings)
-            level (list of strings)
-            related (list of strings)
+            topic (tuple of strings)
+            level (tuple of strings)
+            related (tuple of strings)
             desc (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 by (string)
                 src (string)
                 text (text)
             term (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 gr (string)
                 by (string)
                 src (string)
@@ -571,30 +1934,30 @@ class Glossary (Gnode):
                     text (text)
                 decl (list of g-nodes)
                     lang (string)
-                    env (list of strings)
+                    env (tuple of strings)
                     gr (string)
                     text (text)
                 comment (d-set)
                     lang (string)
-                    env (list of strings)
+                    env (tuple of strings)
                     by (string)
                     text (text)
                 origin (d-set)
                     lang (string)
-                    env (list of strings)
+                    env (tuple of strings)
                     by (string)
                     src (string)
                     text (text)
             details (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 root (string)
                 rel (string)
                 by (string)
                 text (text)
             media (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 root (string)
                 rel (string)
                 text (text)
@@ -604,17 +1967,17 @@ class Glossary (Gnode):
             id (string)
             name (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 text (text)
             shortname (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 text (text)
         environments (dict)
             id (string)
             weight (string)
             meta (string)
-            closeto (list of strings)
+            closeto (tuple of strings)
             name (d-set) ibid.
             shortname (d-set) ibid.
             desc (d-set) ibid.
@@ -627,7 +1990,7 @@ class Glossary (Gnode):
                 text (text)
             affiliation (d-set)
                 lang (string)
-                env (list of strings)
+                env (tuple of strings)
                 text (text)
         sources (dict)
             id (string)
@@ -685,424 +2048,547 @@ class Glossary (Gnode):
     a modified glossary is not implemented yet.
     """
 
-    def __init__ (self, node=None):
+    # There is a single glossary object, free to carry any attributes.
+    __slots__ = ("__dict__",)
+
+    @property
+    def usages (self):
+        """
+        Index of nodes using keys defined in the glossary.
+
+        The index is a dictionary by the name of key dictionary
+        (C{"concepts"}, C{"editors"}, C{"sources"}, C{"topics"},
+        C{"levels"}, and C{"extroots"}), of dictionaries by key,
+        of lists of g-nodes which use that key. A g-node uses a key
+        if one of its attributes states it, or if there is a reference
+        to it in its text. All defined keys are present in the index,
+        with empty lists when they are not used.
+
+        The index is created on first access, when all concepts are
+        constructed even if constructing lazily, and kept up to date
+        by L{update}. Any other modification of the glossary
+        is not reflected in it.
+        """
+
+        if "_key_index" not in self.__dict__:
+            _index_keys(self)
+        return self._key_index
+
+
+    @property
+    def nodes_by_type (self):
+        """
+        Registry of nodes in the glossary, by their type.
+
+        The registry is a dictionary by node class, of lists of nodes
+        of exactly that class, in the order of construction. Each node
+        is listed once, and the glossary itself is not listed.
+        It is filled while constructing the glossary, and kept up to date
+        by L{update}. When constructing lazily, all concepts are
+        constructed on access.
+
+        Any other change of the node structure is not reflected in the
+        registry. Code which adds or removes nodes after construction,
+        such as a sieve, must report them by L{register_nodes} and
+        L{unregister_nodes}. Otherwise, selections by type from the
+        glossary (L{dg.query.iter_descendants}, L{dg.query.descendant_nodes},
+        and type steps in L{dg.query.compile_path}) give stale nodes.
+        """
+
+        if isinstance(self.concepts, _LazyConcepts):
+            self.concepts.values()
+        return self._nodes_by_type
+
+
+    @property
+    def backrefs (self):
+        """
+        Index of nodes referring to concepts, by concept key.
+
+        This is the C{"concepts"} part of L{usages}.
+        """
+
+        return self.usages["concepts"]
+
+
+    def __init__ (self, node=None, parts=True, lazy=False, compact=False):
+        """
+        Constructor.
+
+        If parts are not to be constructed, only the root element attributes
+        are used, and metadata, key definitions and concepts are left empty.
+        They can then be added piecewise, e.g. when constructing while parsing.
+
+        @param node: the root element of the glossary
+        @type node: element from C{lxml.etree}
+        @param parts: whether to construct the parts from children elements
+        @type parts: bool
+        @param lazy: whether to construct concepts on first access
+        @type lazy: bool
+        @param compact: whether to use compact d-sets
+        @type compact: bool
+        """
+
+        Gnode.__init__(self, None, node)
+
+        # All nodes get registered by type while being constructed.
+        self._nodes_by_type = {}
+
+        # Keys and tuples of keys in attributes are shared, see _intern.
+        self._interned = {}
+        self._intern_stats = [0, 0]
+
+        self._dset_type = Dset
+        if compact:
+            self._dset_type = CompactDset
+        self._text_sources = compact
+
+        if lazy:
+            self.concepts = _LazyConcepts(self)
+
+        _content(self, self, node,
+                 [(_attributes,
+                   [["id",
+                     "lang"]]),
+                  (_attrib_lists,
+                   [[("env", (None,))]])])
+
+        # Initialize all parts, to be present even if missing in the XML.
+        self._add_metadata(None)
+        self._add_keydefs(None)
+        self._add_concepts(None)
+        if not parts:
+            return
+
+        for md_node in _child_els_by_tag(node, "metadata"):
+            self._add_metadata(md_node)
+
+        for kd_node in _child_els_by_tag(node, "keydefs"):
+            self._add_keydefs(kd_node)
+
+        # Concepts must be parsed after keydefs,
+        # e.g. for proper resolution of embedded selectors.
+        for cn_node in _child_els_by_tag(node, "concepts"):
+            self._add_concepts(cn_node)
+
+
+    def _add_metadata (self, md_node):
+
+        _content(self, self, md_node,
+                 [(_child_dsets,
+                   [[("title", Title),
+                     ("desc", Desc, ("desc", "ldesc")),
+                     ("version", Version)]]),
+                  (_children,
+                   [[("date", Date)]])])
+
+
+    def _add_keydefs (self, kd_node):
+
+        for chmspec in [("languages", Language, "language"),
+                        ("environments", Environment, "environment"),
+                        ("editors", Editor, "editor"),
+                        ("sources", Source, "source"),
+                        ("topics", Topic, "topic"),
+                        ("levels", Level, "level"),
+                        ("grammar", Gramm, "gramm"),
+                        ("extroots", Extroot, "extroot")]:
+            for kds_node in _child_els_by_tag(kd_node, chmspec[0], [None]):
+                _content(self, self, kds_node,
+                         [(_child_dicts, [[chmspec]])])
+            for key in getattr(self, chmspec[0]):
+                self._interned.setdefault(key, key)
+
+        # Resolve environment closeness once, for selections in d-sets.
+        self._env_fallbacks, self._env_closers = \
+            _env_closeness(self.environments)
+
+
+    # Drop environment closeness tables, when environments may have been
+    # renamed; they are resolved again on next access, from environments
+    # as they are then.
+    def _reset_env_closeness (self):
+
+        self.__dict__.pop("_env_fallbacks", None)
+        self.__dict__.pop("_env_closers", None)
+
+
+    def __getattr__ (self, attname):
+
+        if attname in ("_env_fallbacks", "_env_closers"):
+            self._env_fallbacks, self._env_closers = \
+                _env_closeness(self.__dict__.get("environments", {}))
+            return self.__dict__[attname]
+        raise AttributeError(attname)
+
+
+    def _add_concepts (self, cn_node):
+
+        if isinstance(getattr(self, "concepts", None), _LazyConcepts):
+            for c_node in _child_els_by_tag(cn_node, "concept"):
+                self.concepts._add_source(_attval(c_node, "id"), c_node)
+            return
+
+        _content(self, self, cn_node,
+                 [(_child_dicts, [[("concepts", Concept, "concept")]])])
+
 
-        Gnode.__init__(self, None, node)
+    def _add_concept (self, c_node):
 
-        _content(self, self, node,
-                 [(_attributes,
-                   [["id",
-                     "lang"]]),
-                  (_attrib_lists,
-                   [[("env", [None])]])])
-
-        for md_node in _child_els_by_tag(node, "metadata", [None]):
-            _content(self, self, md_node,
-                     [(_child_dsets,
-                       [[("title", Title),
-                         ("desc", Desc, ("desc", "ldesc")),
-                         ("version", Version)]]),
-                      (_children,
-                       [[("date", Date)]])])
-
-        for kd_node in _child_els_by_tag(node, "keydefs", [None]):
-            for chmspec in [("languages", Language, "language"),
-                            ("environments", Environment, "environment"),
-                            ("editors", Editor, "editor"),
-                            ("sources", Source, "source"),
-                            ("topics", Topic, "topic"),
-                            ("levels", Level, "level"),
-                            ("grammar", Gramm, "gramm"),
-                            ("extroots", Extroot, "extroot")]:
-                for kds_node in _child_els_by_tag(kd_node, chmspec[0], [None]):
-                    _content(self, self, kds_node,
-                             [(_child_dicts, [[chmspec]])])
+        if isinstance(self.concepts, _LazyConcepts):
+            # The element is going to be discarded, so keep it serialized.
+            src = (etree.tostring(c_node, with_tail=False), c_node.sourceline)
+            self.concepts._add_source(_attval(c_node, "id"), src)
+            return
 
-        # Concepts must be parsed after keydefs,
-        # e.g. for proper resolution of embedded selectors.
-        for cn_node in _child_els_by_tag(node, "concepts", [None]):
-            _content(self, self, cn_node,
-                     [(_child_dicts, [[("concepts", Concept, "concept")]])])
+        concept = Concept(self, self, c_node)
+        _register(self, concept)
+        self.concepts[concept.id] = concept
 
 
-class Language (Gnode):
+# Tables of environment closeness, as two dictionaries by environment key.
+# The first gives the environments to try when selecting by that one,
+# starting with itself and followed by those it is close to, in order.
+# The second gives the environments close to that one, starting with
+# itself and followed by others in order of the environment dictionary.
+def _env_closeness (environments):
 
-    def __init__ (self, gloss, parent, node=None):
+    fallbacks = {}
+    closers = {}
+    for env, environment in environments.iteritems():
+        fallbacks[env] = tuple([env] + list(environment.closeto))
+        closers.setdefault(env, [env])
+    for env2, environment in environments.iteritems():
+        for env in environment.closeto:
+            envs = closers.setdefault(env, [env])
+            if env2 not in envs:
+                envs.append(env2)
+    for env, envs in closers.items():
+        closers[env] = tuple(envs)
 
-        Gnode.__init__(self, parent, node)
+    return fallbacks, closers
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname)]])])
 
+class _LazyConcepts (dict):
+    """
+    Dictionary of concepts, which constructs each concept on first access.
 
-class Environment (Gnode):
+    Until constructed, the value for a concept key is its source,
+    either the concept element, or the serialized element with
+    the line number where it starts in the document.
+    """
 
-    def __init__ (self, gloss, parent, node=None):
+    def __init__ (self, gloss):
 
-        Gnode.__init__(self, parent, node)
+        dict.__init__(self)
+        self._gloss = gloss
+        self._validate = False
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id", "weight", "meta"]]),
-                  (_attrib_lists,
-                   [["closeto"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("desc", Desc, ("desc", "ldesc"))]])])
 
-        # Make no-environment close to all defined environments.
-        self.closeto.append(None)
+    def _add_source (self, ckey, src):
 
+        dict.__setitem__(self, ckey, src)
 
-class Editor (Gnode):
 
-    def __init__ (self, gloss, parent, node=None):
+    def _construct (self, ckey, src):
 
-        Gnode.__init__(self, parent, node)
+        if isinstance(src, tuple):
+            xmlstr, line = src
+            node = etree.fromstring(xmlstr)
+            for el in node.iter():
+                el.sourceline += line - 1
+        else:
+            node = src
+        concept = Concept(self._gloss, self._gloss, node)
+        _register(self._gloss, concept)
+        if self._validate:
+            _post_dtd_validate_nodes(self._gloss, [concept])
+        dict.__setitem__(self, ckey, concept)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("affiliation", Affiliation),
-                     ("desc", Desc, ("desc", "ldesc"))]]),
-                  (_children,
-                   [[("email", Email)]])])
+        return concept
 
 
-class Source (Gnode):
+    def _constructed_values (self):
 
-    def __init__ (self, gloss, parent, node=None):
+        return [x for x in dict.values(self) if isinstance(x, Concept)]
 
-        Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("desc", Desc, ("desc", "ldesc"))]]),
-                  (_children,
-                   [[("url", Url),
-                     ("email", Email)]])])
+    def __getitem__ (self, ckey):
 
+        val = dict.__getitem__(self, ckey)
+        if not isinstance(val, Concept):
+            val = self._construct(ckey, val)
+        return val
 
-class Topic (Gnode):
 
-    def __init__ (self, gloss, parent, node=None):
+    def get (self, ckey, defval=None):
 
-        Gnode.__init__(self, parent, node)
+        if ckey in self:
+            return self[ckey]
+        return defval
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("desc", Desc, ("desc", "ldesc"))]])])
 
+    def pop (self, ckey, *defval):
 
-class Level (Gnode):
+        if ckey in self:
+            val = self[ckey]
+            dict.__delitem__(self, ckey)
+            return val
+        return dict.pop(self, ckey, *defval)
 
-    def __init__ (self, gloss, parent, node=None):
 
-        Gnode.__init__(self, parent, node)
+    def popitem (self):
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("desc", Desc, ("desc", "ldesc"))]])])
+        ckey, val = dict.popitem(self)
+        if not isinstance(val, Concept):
+            val = self._construct(ckey, val)
+            dict.__delitem__(self, ckey)
+        return ckey, val
 
 
-class Gramm (Gnode):
+    def setdefault (self, ckey, defval=None):
 
-    def __init__ (self, gloss, parent, node=None):
+        if ckey in self:
+            return self[ckey]
+        self[ckey] = defval
+        return defval
 
-        Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("desc", Desc, ("desc", "ldesc"))]])])
+    def itervalues (self):
 
+        for ckey in dict.keys(self):
+            yield self[ckey]
 
-class Extroot (Gnode):
 
-    def __init__ (self, gloss, parent, node=None):
+    def iteritems (self):
 
-        Gnode.__init__(self, parent, node)
+        for ckey in dict.keys(self):
+            yield ckey, self[ckey]
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_child_dsets,
-                   [[("name", Name),
-                     ("shortname", Shortname),
-                     ("desc", Desc, ("desc", "ldesc"))]]),
-                  (_children,
-                   [[("rooturl", RootUrl),
-                     ("browseurl", BrowseUrl)]])])
 
+    def values (self):
 
-class Concept (Gnode):
+        return list(self.itervalues())
 
-    def __init__ (self, gloss, parent, node=None):
 
-        Gnode.__init__(self, parent, node)
+    def items (self):
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [["id"]]),
-                  (_attrib_lists,
-                   [["topic",
-                     "level",
-                     "related"]]),
-                  (_child_dsets,
-                   [[("desc", Desc, ("desc", "ldesc")),
-                     ("term", Term, ("term", "eterm")),
-                     ("details", Details),
-                     ("media", Media),
-                     ("origin", Origin, ("origin", "lorigin")),
-                     ("comment", Comment, ("comment", "lcomment"))]])])
+        return list(self.iteritems())
 
 
-class Term (Gnode):
+    def copy (self):
 
-    def __init__ (self, gloss, parent, node=None):
+        return dict(self.iteritems())
 
-        Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                     "by",
-                     "src",
-                     "gr"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]])])
+    def __reduce__ (self):
 
-        # In case of simple term, run this through with node=None
-        # to have proper initialization of all attributes.
-        vnode = None
-        if _child_els_by_tag(node, "nom"):
-            vnode = node
-        _content(self, gloss, vnode,
-                 [(_child_dsets,
-                   [[("origin", Origin, ("origin", "lorigin")),
-                     ("comment", Comment, ("comment", "lcomment"))]]),
-                  (_child_lists,
-                   [[("decl", Decl)]]),
-                  (_children,
-                   [[("nom", Nom),
-                     ("stem", Stem)]])])
-        if vnode is None:
-            self.nom = Nom(gloss, self, node)
+        # Construct all concepts when pickling or copying.
+        return (dict, (self.items(),))
 
 
 class Title (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang)]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang)]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Version (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang)]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang)]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Name (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang)]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang)]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Shortname (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang)]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang)]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Affiliation (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang)]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang)]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Desc (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang),
+                "by",
+                "src"]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                     "by",
-                     "src"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Origin (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang),
+                "by",
+                "src"]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                     "by",
-                     "src"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Comment (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang),
+                "by"]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                     "by"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Details (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang),
+                "by",
+                "root",
+                "rel"]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                     "by",
-                     "root",
-                     "rel"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Media (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang),
+                "by",
+                "root",
+                "rel"]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                     "by",
-                     "root",
-                     "rel"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Decl (Gnode):
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang),
+                 "gr"]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang),
-                      "gr"]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class OnlyText (Gnode): # subclass for nodes having no attributes, only text
 
+    _spec = [(_attributes,
+              [[("lang", _gloss_lang)]]),
+             (_attrib_lists,
+              [[("env", _gloss_env)]]),
+             (_text,
+              [])]
+
     def __init__ (self, gloss, parent, node=None):
 
         Gnode.__init__(self, parent, node)
 
-        _content(self, gloss, node,
-                 [(_attributes,
-                   [[("lang", gloss.lang)]]),
-                  (_attrib_lists,
-                   [[("env", gloss.env)]]),
-                  (_text,
-                   [])])
+        _content(self, gloss, node, self._spec)
 
 
 class Date (OnlyText):
@@ -1154,19 +2640,223 @@ class Stem (OnlyText):
         OnlyText.__init__(self, gloss, parent, node)
 
 
+class Language (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname)]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Environment (Gnode):
+
+    _spec = [(_attributes,
+              [["id", "weight", "meta"]]),
+             (_attrib_lists,
+              [["closeto"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("desc", Desc, ("desc", "ldesc"))]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+        # Make no-environment close to all defined environments.
+        self.closeto = _intern(gloss, tuple(self.closeto) + (None,))
+
+
+class Editor (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("affiliation", Affiliation),
+                ("desc", Desc, ("desc", "ldesc"))]]),
+             (_children,
+              [[("email", Email)]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Source (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("desc", Desc, ("desc", "ldesc"))]]),
+             (_children,
+              [[("url", Url),
+                ("email", Email)]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Topic (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("desc", Desc, ("desc", "ldesc"))]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Level (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("desc", Desc, ("desc", "ldesc"))]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Gramm (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("desc", Desc, ("desc", "ldesc"))]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Extroot (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_child_dsets,
+              [[("name", Name),
+                ("shortname", Shortname),
+                ("desc", Desc, ("desc", "ldesc"))]]),
+             (_children,
+              [[("rooturl", RootUrl),
+                ("browseurl", BrowseUrl)]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
+class Term (Gnode):
+
+    _spec_atts = [(_attributes,
+                   [[("lang", _gloss_lang),
+                     "by",
+                     "src",
+                     "gr"]]),
+                  (_attrib_lists,
+                   [[("env", _gloss_env)]])]
+
+    _spec_parts = [(_child_dsets,
+                    [[("origin", Origin, ("origin", "lorigin")),
+                      ("comment", Comment, ("comment", "lcomment"))]]),
+                   (_child_lists,
+                    [[("decl", Decl)]]),
+                   (_children,
+                    [[("nom", Nom),
+                      ("stem", Stem)]])]
+
+    _spec = _spec_atts + _spec_parts
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec_atts)
+
+        # In case of simple term, run this through with node=None
+        # to have proper initialization of all attributes.
+        vnode = None
+        if _child_els_by_tag(node, "nom"):
+            vnode = node
+        _content(self, gloss, vnode, self._spec_parts)
+        if vnode is None:
+            self.nom = Nom(gloss, self, node)
+            _register(gloss, self.nom)
+
+
+class Concept (Gnode):
+
+    _spec = [(_attributes,
+              [["id"]]),
+             (_attrib_lists,
+              [["topic",
+                "level",
+                "related"]]),
+             (_child_dsets,
+              [[("desc", Desc, ("desc", "ldesc")),
+                ("term", Term, ("term", "eterm")),
+                ("details", Details),
+                ("media", Media),
+                ("origin", Origin, ("origin", "lorigin")),
+                ("comment", Comment, ("comment", "lcomment"))]])]
+
+    def __init__ (self, gloss, parent, node=None):
+
+        Gnode.__init__(self, parent, node)
+
+        _content(self, gloss, node, self._spec)
+
+
 # Text.
 # Organized as a list of structured text segments,
 # where the basic segment is plain string.
 
 class Text (list): # base class for all in-text elements
 
+    __slots__ = ("src_line",)
+
+    src_file = p_("an unknown file", "<unknown>")
+
     def __init__ (self, node=None, tags=None):
 
         self.src_line = 0
-        self.src_file = p_("an unknown file", "<unknown>")
         if node is not None:
             self.src_line = node.sourceline
-            # self.src_file = ?
 
         if tags is None:
             tags = ["para", "ref", "em", "ol", "link"]
@@ -1174,8 +2864,33 @@ class Text (list): # base class for all in-text elements
         self.extend(_text_segments(node, tags))
 
 
+# Text kept as the serialized element it comes from, when constructing
+# compactly, and parsed into Text only when needed (see _gnode_get_text).
+# The source takes much less memory than the text, with its segments
+# as separate strings and lists.
+class _TextSource (str):
+
+    __slots__ = ()
+
+    # Parse the source into text, with the element at the given line.
+    def parse (self, src_line):
+
+        text = Text(etree.fromstring(self))
+
+        # Line numbers within the source are relative to the element.
+        texts = [text]
+        while texts:
+            text1 = texts.pop()
+            text1.src_line += src_line - 1
+            texts.extend([x for x in text1 if isinstance(x, Text)])
+
+        return text
+
+
 class Para (Text):
 
+    __slots__ = ()
+
     def __init__ (self, node=None):
 
         Text.__init__(self, node, ["ref", "em", "ol", "link"])
@@ -1183,6 +2898,8 @@ class Para (Text):
 
 class Ref (Text):
 
+    __slots__ = ("c",)
+
     def __init__ (self, node=None):
 
         Text.__init__(self, node, ["em", "ol"])
@@ -1191,6 +2908,8 @@ class Ref (Text):
 
 class Em (Text):
 
+    __slots__ = ()
+
     def __init__ (self, node=None):
 
         Text.__init__(self, node, ["ref", "em", "ol", "link"])
@@ -1198,6 +2917,8 @@ class Em (Text):
 
 class Ol (Text):
 
+    __slots__ = ("lang", "wl")
+
     def __init__ (self, node=None):
 
         Text.__init__(self, node, ["ref", "em", "ol"])
@@ -1207,6 +2928,8 @@ class Ol (Text):
 
 class Link (Text):
 
+    __slots__ = ("url",)
+
     def __init__ (self, node=None):
 
         Text.__init__(self, node, ["em", "ol"])
@@ -1225,38 +2948,102 @@ _tseg_name_type = {"para":Para, "ref":Ref, "em":Em, "ol":Ol, "link":Link}
 # and the text in them resolved accordingly.
 def _res_embsel (gloss, obj):
 
-    if not (hasattr(obj, "text") and hasattr(obj, "env")):
+    text = getattr(obj, "_text", None)
+    if text is None or not hasattr(obj, "env"):
+        return [obj]
+
+    # Most texts have no embedded selectors, check that quickly,
+    # without parsing texts in source form.
+    if isinstance(text, _TextSource):
+        if "~" not in text:
+            return [obj]
+    elif not _res_embsel_any_tilde(text):
         return [obj]
 
     # Normalize text: each embedded selector is turned into its own segment
     # of the text, a dictionary of env/string;
     # all encountered environments are reported.
+    # This is done only once, and then used to resolve each environment.
     ntext, envs = _res_embsel_norm_text(obj.text, obj.env)
     if not envs:
         return [obj]
 
     # Create a version of the object for each of the environments.
     robjs = []
-    parent = obj.parent
-    obj.parent = None # to avoid going up on deep copy
     for env in envs:
         # Piece up the best version of text for current environment.
         text = _res_embsel_best_text(gloss, ntext, env)
 
         # Create object with this environment and text.
-        robj = copy.deepcopy(obj)
-        robj.parent = parent
-        robj.env = [env]
+        # Nodes with text have no subnodes and their other attributes
+        # are not modified, so a shallow copy of the node suffices.
+        robj = _gnode_shell(obj)
+        robj.env = _intern_keys(gloss, [env])
         robj.text = text
         robjs.append(robj)
 
     return robjs
 
 
+def _res_embsel_any_tilde (text):
+
+    for seg in text:
+        if isinstance(seg, Text):
+            if _res_embsel_any_tilde(seg):
+                return True
+        elif "~" in seg:
+            return True
+
+    return False
+
+
+# Copy of the glossary node sharing all attribute values.
+def _gnode_shell (gnode):
+
+    ngnode = gnode.__class__.__new__(gnode.__class__)
+    for attname, val in _gnode_items(gnode):
+        setattr(ngnode, attname, val)
+
+    return ngnode
+
+
+# Copy of the text without its segments.
+def _text_shell (text):
+
+    ntext = text.__class__.__new__(text.__class__)
+    for attname in _text_attnames(text.__class__):
+        val = getattr(text, attname, _text_shell)
+        if val is not _text_shell:
+            setattr(ntext, attname, val)
+
+    return ntext
+
+
+_text_attnames_by_type = {}
+
+def _text_attnames (cls):
+
+    attnames = _text_attnames_by_type.get(cls)
+    if attnames is None:
+        attnames = []
+        for scls in cls.__mro__:
+            attnames.extend(scls.__dict__.get("__slots__", ()))
+        _text_attnames_by_type[cls] = attnames
+
+    return attnames
+
+
+# Segment of normalized text made from an embedded selector,
+# mapping environments to strings.
+class _EnvSegments (dict):
+
+    # Original embedded selector string, needed later for error reporting.
+    __slots__ = ("unparsed",)
+
+
 def _res_embsel_norm_text (text, denvs):
 
-    ntext = copy.copy(text)
-    ntext[:] = []
+    ntext = _text_shell(text)
     envs = set()
 
     for i in range(len(text)):
@@ -1300,8 +3087,7 @@ def _res_embsel_parse_one (seg, denvs):
             p2 = p1 - 1
             break
 
-        class DictWProps (dict): pass
-        envsegs = DictWProps()
+        envsegs = _EnvSegments()
         locenvs = set()
         for eseg in seg[p1+1:p2].split("|"):
             pc = eseg.find(":")
@@ -1324,8 +3110,6 @@ def _res_embsel_parse_one (seg, denvs):
             for cenv in cenvs:
                 envsegs[cenv] = cseg
 
-        # Add embedded selector string under a dummy environment,
-        # needed later for error reporting.
         envsegs.unparsed = seg
 
         ntext.append(envsegs)
@@ -1342,8 +3126,7 @@ def _res_embsel_parse_one (seg, denvs):
 
 def _res_embsel_best_text (gloss, ntext, env):
 
-    text = copy.copy(ntext)
-    text[:] = []
+    text = _text_shell(ntext)
     for seg in ntext:
         if isinstance(seg, Text):
             text.append(_res_embsel_best_text(gloss, seg, env))
@@ -1368,8 +3151,9 @@ def _res_embsel_best_text (gloss, ntext, env):
                                    "no resolution for expected environment "
                                    "'%(env)s' in embedded selector '%(esel)s'")
                                 % dict(env=env, esel=seg.unparsed))
-                    # Pick at random.
-                    text.append(random.choice(seg.values()))
+                    # Pick by first environment key, so that the same
+                    # glossary always resolves the same way.
+                    text.append(seg[min(seg)])
         else:
             text.append(seg)
 
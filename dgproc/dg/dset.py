@@ -7,12 +7,21 @@ Handler for glossary parts which can differ by language and environment.
 @license: GPLv3
 """
 
+from array import array
+from itertools import izip
+
 from dg.util import p_
 from dg.util import error
 
 
 class Dset (object):
 
+    __slots__ = ("gloss", "parent", "_data", "_inh")
+
+    # Number of renamings of keys in any d-set so far.
+    # Inherited attributes resolved before a renaming are resolved again.
+    _renamings = 0
+
     def __init__ (self, gloss, parent=None):
 
         self.gloss = gloss
@@ -35,14 +44,40 @@ class Dset (object):
         return val
 
 
-    def add (self, obj):
+    # Language and environments inherited from parents,
+    # resolved on first request and kept until a renaming.
+    def _inherited (self):
+
+        inh = getattr(self, "_inh", None)
+        if inh is None or inh[0] != Dset._renamings:
+            inh = (Dset._renamings, self._parent_att("lang", None),
+                   self._parent_att("env", (None,)))
+            self._inh = inh
+        return inh
+
+
+    # Language and environments by which an object is to be selected.
+    def _obj_langenvs (self, obj):
 
         lang = obj.lang
         if lang is None:
-            lang = self._parent_att("lang", None)
+            lang = self._inherited()[1]
         envs = obj.env
         if not envs:
-            envs = self._parent_att("env", [None])
+            envs = self._inherited()[2]
+
+        return lang, envs
+
+
+    # Environments having objects in the given language, or None if none.
+    def _lang_envs (self, lang):
+
+        return self._data.get(lang)
+
+
+    def add (self, obj):
+
+        lang, envs = self._obj_langenvs(obj)
 
         if lang not in self._data:
             self._data[lang] = {}
@@ -55,25 +90,57 @@ class Dset (object):
     def __call__ (self, lang=None, env=None):
 
         if lang is None:
-            lang = self._parent_att("lang", None)
+            lang = self._inherited()[1]
         if env is None:
-            env = self._parent_att("env", [None])[0]
+            env = self._inherited()[2][0]
 
-        if lang not in self._data:
+        envdata = self._data.get(lang)
+        if envdata is None:
             return []
 
-        if env not in self._data[lang] and self.gloss.environments:
-            # Try to select environment by closeness.
-            environment = self.gloss.environments[env]
-            for close_env in environment.closeto:
-                if close_env in self._data[lang]:
-                    env = close_env
-                    break
+        # Try to select environment by closeness.
+        for close_env in self.gloss._env_fallbacks.get(env, (env,)):
+            objs = envdata.get(close_env)
+            if objs is not None:
+                return objs
+
+        return []
+
+
+    def first (self, lang, envs):
+        """
+        Select by the first of given environments which selects anything.
+
+        This is the same as calling the d-set with each of the environments
+        in turn, until a non-empty selection.
+
+        @param lang: language key
+        @type lang: string or C{None}
+        @param envs: environment keys
+        @type envs: sequence of strings
+
+        @return: the selection
+        @rtype: list
+        """
 
-        if env not in self._data[lang]:
+        if lang is None:
+            lang = self._inherited()[1]
+
+        langenvs = self._lang_envs(lang)
+        if langenvs is None:
             return []
 
-        return self._data[lang][env]
+        # Only environments close to some of those present can select.
+        closers = self.gloss._env_closers
+        selenvs = set()
+        for env in langenvs:
+            selenvs.update(closers.get(env, (env,)))
+
+        for env in envs:
+            if env in selenvs:
+                return self(lang, env)
+
+        return []
 
 
     def values (self):
@@ -89,18 +156,20 @@ class Dset (object):
     def envs (self, lang=None):
 
         if lang is None:
-            lang = self._parent_att("lang", None)
+            lang = self._inherited()[1]
 
-        if lang not in self._data:
+        langenvs = self._lang_envs(lang)
+        if langenvs is None:
             return None
 
         # Must collect also the environments close to this one.
         envs = []
-        for env in self._data[lang]:
-            if env not in envs:
-                envs.append(env)
-            for env2, environment in self.gloss.environments.iteritems():
-                if env in environment.closeto and env2 not in envs:
+        seen = set()
+        closers = self.gloss._env_closers
+        for env in langenvs:
+            for env2 in closers.get(env, (env,)):
+                if env2 not in seen:
+                    seen.add(env2)
                     envs.append(env2)
 
         return envs
@@ -108,13 +177,150 @@ class Dset (object):
 
     def rename_lang (self, olang, nlang):
 
+        Dset._renamings += 1
         if olang in self._data:
             self._data[nlang] = self._data.pop(olang)
 
 
     def rename_env (self, oenv, nenv):
 
+        Dset._renamings += 1
+        self.gloss._reset_env_closeness()
         for lang, envs in self._data.iteritems():
             if oenv in envs:
                 envs[nenv] = envs.pop(oenv)
 
+
+# Interned pairs of language and environment keys, by small integer code,
+# and the codes by pairs.
+_code_pairs = []
+_pair_codes = {}
+
+def _pair_code (lang, env):
+
+    code = _pair_codes.get((lang, env))
+    if code is None:
+        code = len(_code_pairs)
+        _code_pairs.append((lang, env))
+        _pair_codes[(lang, env)] = code
+    return code
+
+
+class CompactDset (Dset):
+    """
+    D-set storing each object only once.
+
+    Objects are kept in a single list, in the order of addition.
+    For each language and environment by which an object is selected,
+    the code of the language-environment pair and the position of
+    the object are recorded into two arrays. This takes much less memory
+    than dictionaries of lists by language and environment, for the price
+    of scanning the arrays on selection, which is cheap since a d-set
+    usually contains only a few objects.
+
+    Selection and listing of languages and environments behave
+    as in L{Dset}, but L{values} gives an iterator over distinct objects.
+    """
+
+    __slots__ = ("_objs", "_codes", "_poss")
+
+    def __init__ (self, gloss, parent=None):
+
+        self.gloss = gloss
+        self.parent = parent
+        if parent is None:
+            self.parent = gloss
+
+        self._objs = []
+        self._codes = array("i")
+        self._poss = array("I")
+
+
+    # Pair codes are particular to the process, so pickle the pairs.
+    def __getstate__ (self):
+
+        return (self.gloss, self.parent, self._objs,
+                [_code_pairs[x] for x in self._codes], self._poss)
+
+
+    def __setstate__ (self, state):
+
+        self.gloss, self.parent, self._objs, pairs, self._poss = state
+        self._codes = array("i", [_pair_code(*x) for x in pairs])
+
+
+    def _lang_envs (self, lang):
+
+        # Collect into a dictionary, for the same order as in plain d-set.
+        envs = {}
+        for code in self._codes:
+            clang, env = _code_pairs[code]
+            if clang == lang:
+                envs[env] = True
+        if not envs:
+            return None
+        return envs.keys()
+
+
+    def add (self, obj):
+
+        lang, envs = self._obj_langenvs(obj)
+
+        pos = len(self._objs)
+        self._objs.append(obj)
+        for env in envs:
+            self._codes.append(_pair_code(lang, env))
+            self._poss.append(pos)
+
+
+    def __call__ (self, lang=None, env=None):
+
+        if lang is None:
+            lang = self._inherited()[1]
+        if env is None:
+            env = self._inherited()[2][0]
+
+        # Try to select environment by closeness.
+        for close_env in self.gloss._env_fallbacks.get(env, (env,)):
+            code = _pair_codes.get((lang, close_env))
+            if code is not None and code in self._codes:
+                objs = self._objs
+                return [objs[p] for c, p in izip(self._codes, self._poss)
+                        if c == code]
+
+        return []
+
+
+    def values (self):
+
+        return iter(self._objs)
+
+
+    def langs (self):
+
+        # Collect into a dictionary, for the same order as in plain d-set.
+        langs = {}
+        for code in self._codes:
+            langs[_code_pairs[code][0]] = True
+        return langs.keys()
+
+
+    def rename_lang (self, olang, nlang):
+
+        Dset._renamings += 1
+        codes = self._codes
+        for i in xrange(len(codes)):
+            lang, env = _code_pairs[codes[i]]
+            if lang == olang:
+                codes[i] = _pair_code(nlang, env)
+
+
+    def rename_env (self, oenv, nenv):
+
+        Dset._renamings += 1
+        self.gloss._reset_env_closeness()
+        codes = self._codes
+        for i in xrange(len(codes)):
+            lang, env = _code_pairs[codes[i]]
+            if env == oenv:
+                codes[i] = _pair_code(lang, nenv)
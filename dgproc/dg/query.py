@@ -7,8 +7,14 @@ Methods for selection data within the glossary.
 @license: GPLv3
 """
 
+import re
+
+from dg.util import p_
+from dg.util import error
 from dg.dset import Dset
-from dg.construct import Gnode, Text
+from dg.construct import Gnode, Glossary, Text, _gnode_items, _TextSource
+from dg.construct import _post_dtd_key_atts
+import dg.construct
 
 
 def child_nodes (gnode, gtype=None):
@@ -22,6 +28,10 @@ def child_nodes (gnode, gtype=None):
     than only the nodes with this type will be selected.
     If several types are wanted, they can be given as a sequence.
 
+    Texts may be selected too, by giving L{Text} as the type.
+    Texts kept in source form (see L{dg.construct.from_file}) are then
+    parsed for the selection, but are left in source form in the node.
+
     @param gnode: a glossary node
     @type gnode: L{Gnode}
     @param gtype: a type of glossary nodes
@@ -31,31 +41,10 @@ def child_nodes (gnode, gtype=None):
     @rtype: list of L{Gnode}
     """
 
-    flatlst = []
-    for attrname, attr in gnode.__dict__.iteritems():
-        if attrname.startswith("_") or attrname == "parent":
-            continue
-
-        if type(attr) == Dset:
-            flatlst.extend(attr.values())
-        elif type(attr) == dict:
-            flatlst.extend(attr.values())
-        elif type(attr) == list:
-            flatlst.extend(attr)
-        else:
-            flatlst.append(attr)
-
-        # NOTE: If at any point changing type() to isinstance() above,
-        # take care that Text is a subclass of list.
-
-        if gtype is None:
-            gtype = Gnode
-        if hasattr(gtype, "__iter__"):
-            gtypes = tuple(gtype)
-        else:
-            gtypes = (gtype,)
-
-    return [x for x in flatlst if isinstance(x, gtypes)]
+    gtypes = _gtypes(gtype)
+    texts = bool([x for x in gtypes
+                  if issubclass(x, Text) or issubclass(Text, x)])
+    return [x for x in _child_nodes(gnode, texts) if isinstance(x, gtypes)]
 
 
 def descendant_nodes (gnode, gtype=None):
@@ -73,22 +62,12 @@ def descendant_nodes (gnode, gtype=None):
 
     @return: descendant glossary nodes
     @rtype: list of L{Gnode}
-    """
-
-    children = child_nodes(gnode)
-    descendants = []
-    for child in children:
-        descendants.append(child)
-        descendants.extend(descendant_nodes(child))
 
-    if gtype is not None:
-        if hasattr(gtype, "__iter__"):
-            gtypes = tuple(gtype)
-        else:
-            gtypes = (gtype,)
-        descendants = [x for x in descendants if isinstance(x, gtypes)]
+    @see: L{iter_descendants} for the order of nodes, which is not
+        the tree order when selecting by type from the glossary
+    """
 
-    return descendants
+    return list(iter_descendants(gnode, gtype))
 
 
 def descendant_dsets (gnode):
@@ -102,15 +81,363 @@ def descendant_dsets (gnode):
     @rtype: list of L{Dset}
     """
 
-    dsets = []
-    for attrname, attr in gnode.__dict__.iteritems():
+    return list(iter_dsets(gnode))
+
+
+def iter_descendants (gnode, gtype=None):
+    """
+    Iterate over descendent nodes of a glossary node.
+
+    Nodes are given in the same order as by L{descendant_nodes},
+    but without first collecting them, and selecting by type
+    while walking the subtree.
+
+    When the node is the glossary and a type is given, the nodes are
+    taken from L{Glossary.nodes_by_type} instead of walking the glossary.
+    They are then not in the tree order: they are grouped by class,
+    each node is given once, and within a class they are in the order
+    of construction. Nodes added or removed after construction are
+    reflected only if reported to the registry, see
+    L{dg.construct.register_nodes}. To get nodes of several types in
+    the tree order, select all nodes and filter them by type.
+
+    @param gnode: a glossary node
+    @type gnode: L{Gnode}
+    @param gtype: a type of glossary nodes
+    @type gtype: subclass of L{Gnode}, or a sequence thereof
+
+    @return: iterator over descendant glossary nodes
+    @rtype: iterator of L{Gnode}
+    """
+
+    gtypes = _gtypes(gtype)
+    if gtype is not None and isinstance(gnode, Glossary):
+        nodes = []
+        for cls, clsnodes in gnode.nodes_by_type.iteritems():
+            if issubclass(cls, gtypes):
+                nodes.extend(clsnodes)
+        return iter(nodes)
+
+    return _iter_descendants(gnode, gtypes)
+
+
+def _iter_descendants (gnode, gtypes):
+
+    # Iterators over children of nodes on the path to the current node.
+    stack = [iter(_child_nodes(gnode))]
+    while stack:
+        for child in stack[-1]:
+            if isinstance(child, Gnode):
+                if isinstance(child, gtypes):
+                    yield child
+                stack.append(iter(_child_nodes(child)))
+                break
+        else:
+            stack.pop()
+
+
+def iter_dsets (gnode):
+    """
+    Iterate over descendent d-sets of a glossary node.
+
+    D-sets are given in the same order as by L{descendant_dsets}.
+
+    @param gnode: a glossary node
+    @type gnode: L{Gnode}
+
+    @return: iterator over descendant dsets
+    @rtype: iterator of L{Dset}
+    """
+
+    for dset in _own_dsets(gnode):
+        yield dset
+    for child in _iter_descendants(gnode, (Gnode,)):
+        for dset in _own_dsets(child):
+            yield dset
+
+
+# Normalize the type selection to a tuple of types.
+def _gtypes (gtype):
+
+    if gtype is None:
+        return (Gnode,)
+    elif not isinstance(gtype, type) and hasattr(gtype, "__iter__"):
+        return tuple(gtype)
+    else:
+        return (gtype,)
+
+
+# Attributes of the given node, with those holding several objects
+# flattened out, to be selected from by type.
+# Texts in source form are left out, unless texts are requested,
+# when they are parsed without storing the result into the node,
+# so that walking the glossary does not undo its compact form.
+def _child_nodes (gnode, texts=False):
+
+    flatlst = []
+    for attrname, attr in _gnode_items(gnode):
         if attrname.startswith("_") or attrname == "parent":
             continue
-        if isinstance(attr, Dset):
-            dsets.append(attr)
+        if isinstance(attr, _TextSource):
+            if not texts:
+                continue
+            attr = attr.parse(gnode.src_line)
+
+        if isinstance(attr, (Dset, dict)):
+            flatlst.extend(attr.values())
+        elif type(attr) == list:
+            flatlst.extend(attr)
+        else:
+            flatlst.append(attr)
+
+        # NOTE: If at any point changing type() to isinstance() above,
+        # take care that Text is a subclass of list.
+
+    return flatlst
+
+
+# D-set attributes of the given node.
+def _own_dsets (gnode):
+
+    return [x for n, x in _gnode_items(gnode)
+            if isinstance(x, Dset) and not n.startswith("_") and n != "parent"]
+
+
+def compile_path (path):
+    """
+    Compile a path expression for selecting glossary data.
+
+    The path is a sequence of steps separated by C{/}, starting from
+    the given node, like::
+
+        concepts[topic=astro]/term[lang=en,env=kde]/nom
+
+    Each step names an attribute of the nodes selected so far,
+    and selects its value, or all values in it if it holds several
+    (a list, dictionary or d-set). A step separated by C{//} instead
+    names a node type (class name in lowercase, e.g. C{term}),
+    and selects all descendant nodes of that type. The step name C{*}
+    selects all child or descendant nodes, respectively.
+
+    A step may be followed by predicates in brackets, separated by commas.
+    The predicate C{att=value} keeps the nodes having the attribute equal
+    to the value, or containing the value if the attribute is a list
+    (e.g. of topic keys). The predicate C{att} keeps the nodes having
+    the attribute set to anything non-empty. On steps selecting from
+    d-sets, the C{lang} and C{env} predicates select as the d-set does,
+    including the fallback by environment closeness.
+
+    The path is compiled once into a function, which takes the node
+    to start from and returns an iterator over selected values.
+    Values are selected lazily, while the iterator is advanced.
+    When the key usage index of the glossary has been created
+    (see L{Glossary.usages}), steps selecting key definitions
+    or concepts by a key attribute take candidates from the index,
+    and steps by type take nodes from L{Glossary.nodes_by_type}.
+
+    @param path: the path expression
+    @type path: string
+
+    @return: function selecting values from a glossary node
+    @rtype: (L{Gnode}) -> iterator
+    """
+
+    stages = [_compile_step(sep, name, preds, path)
+              for sep, name, preds in _parse_path(path)]
+
+    def select (gnode):
+        items = iter([gnode])
+        for stage in stages:
+            items = stage(items)
+        return items
+
+    return select
+
+
+_compiled_paths = {}
+
+def select_path (gnode, path):
+    """
+    Select glossary data by a path expression.
+
+    The path is compiled on first use, and the compiled function reused.
+
+    @param gnode: a glossary node to start from
+    @type gnode: L{Gnode}
+    @param path: the path expression
+    @type path: string
+
+    @return: iterator over selected values
+    @rtype: iterator
+
+    @see: L{compile_path} for the syntax of path expressions
+    """
+
+    select = _compiled_paths.get(path)
+    if select is None:
+        select = compile_path(path)
+        _compiled_paths[path] = select
+
+    return select(gnode)
+
+
+_path_step_rx = re.compile(r"\s*(//|/|)\s*([\w-]+|\*)\s*(?:\[([^\]]*)\])?\s*",
+                           re.U)
+_path_pred_rx = re.compile(r"^\s*([\w-]+)\s*(?:=\s*(.*?)\s*)?$", re.U)
+
+# Split the path into steps, as (separator, name, predicates) tuples,
+# where predicates are (attribute, value) pairs, with value None
+# for the test of presence.
+def _parse_path (path):
+
+    steps = []
+    pos = 0
+    while pos < len(path):
+        m = _path_step_rx.match(path, pos)
+        if not m or m.end() == pos or (not m.group(1) and steps):
+            error(p_("error message",
+                     "invalid path expression at column %(col)d: %(path)s")
+                  % dict(col=(pos + 1), path=path))
+        preds = []
+        if m.group(3) is not None:
+            for predstr in m.group(3).split(","):
+                mp = _path_pred_rx.match(predstr)
+                if not mp:
+                    error(p_("error message",
+                             "invalid predicate '%(pred)s' "
+                             "in path expression: %(path)s")
+                          % dict(pred=predstr.strip(), path=path))
+                preds.append(mp.groups())
+        steps.append((m.group(1) or "/", m.group(2), preds))
+        pos = m.end()
+
+    if not steps:
+        error(p_("error message",
+                 "empty path expression"))
+
+    return steps
+
+
+# Node types by their names in path expressions.
+_path_types = dict([(x.__name__.lower(), x)
+                    for x in vars(dg.construct).values()
+                    if isinstance(x, type) and issubclass(x, Gnode)])
+
+# Key dictionaries by the attributes stating keys.
+_path_key_dicts = dict([(x[0], x[1]) for x in _post_dtd_key_atts])
+
+# Compile a single path step into a function
+# from an iterator of values to an iterator of selected values.
+def _compile_step (sep, name, preds, path):
+
+    tests = [_compile_pred(att, val) for att, val in preds]
+
+    if sep == "//":
+        if name == "*":
+            gtype = None
+        else:
+            gtype = _path_types.get(name)
+            if gtype is None:
+                error(p_("error message",
+                         "unknown node type '%(type)s' "
+                         "in path expression: %(path)s")
+                      % dict(type=name, path=path))
+        def step (items):
+            for item in items:
+                if isinstance(item, Gnode):
+                    for gnode in iter_descendants(item, gtype):
+                        if _path_pass(gnode, tests):
+                            yield gnode
+        return step
+
+    # Language and environment select from d-sets on their own.
+    dset_lang = dict(preds).get("lang")
+    dset_env = dict(preds).get("env")
+    dset_tests = [_compile_pred(att, val) for att, val in preds
+                  if att not in ("lang", "env")]
+
+    # A key predicate, for taking candidates from the usage index.
+    keypreds = [(att, val) for att, val in preds
+                if val is not None and att in _path_key_dicts]
+
+    def step (items):
+        for item in items:
+            if not isinstance(item, Gnode):
+                continue
+            if name == "*":
+                for child in _child_nodes(item):
+                    if isinstance(child, Gnode) and _path_pass(child, tests):
+                        yield child
+                continue
+            if name.startswith("_") or name == "parent":
+                continue
+            value = getattr(item, name, None)
+            if value is None:
+                continue
+            if isinstance(value, Dset):
+                if dset_lang is not None or dset_env is not None:
+                    objs = value(dset_lang, dset_env)
+                else:
+                    objs = value.values()
+                for obj in objs:
+                    if _path_pass(obj, dset_tests):
+                        yield obj
+            elif isinstance(value, dict):
+                objs = None
+                if keypreds and isinstance(item, Glossary):
+                    objs = _path_indexed(item, value, keypreds)
+                if objs is None:
+                    objs = value.itervalues()
+                for obj in objs:
+                    if _path_pass(obj, tests):
+                        yield obj
+            elif isinstance(value, (list, tuple)) and not isinstance(value, Text):
+                for obj in value:
+                    if _path_pass(obj, tests):
+                        yield obj
+            elif _path_pass(value, tests):
+                yield value
+
+    return step
+
+
+# Candidates from a key dictionary of the glossary stating the key
+# of a predicate, taken from the key usage index if it exists.
+def _path_indexed (gloss, keydict, keypreds):
+
+    keyindex = gloss.__dict__.get("_key_index")
+    if keyindex is None:
+        return None
+    for att, val in keypreds:
+        users = keyindex.get(_path_key_dicts[att])
+        if users is not None:
+            return [x for x in users.get(val, [])
+                    if keydict.get(getattr(x, "id", None)) is x]
+
+    return None
+
+
+# Compile a single predicate into a test on a value.
+def _compile_pred (att, val):
+
+    if val is None:
+        def test (obj):
+            return bool(getattr(obj, att, None))
+    else:
+        def test (obj):
+            value = getattr(obj, att, None)
+            if isinstance(value, basestring):
+                return value == val
+            elif isinstance(value, (list, tuple)):
+                return val in value
+            return False
+
+    return test
 
-    for child in child_nodes(gnode):
-        dsets.extend(descendant_dsets(child))
 
-    return dsets
+def _path_pass (obj, tests):
 
+    for test in tests:
+        if not test(obj):
+            return False
+    return True
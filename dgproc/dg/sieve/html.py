@@ -13,14 +13,13 @@ import time
 import unicodedata
 import re
 import shutil
-import random
 
 from dg import rootdir
 from dg.util import p_, np_
 from dg.util import error, warning
 from dg.textfmt import TextFormatterPlain, TextFormatterHtml
 from dg.textfmt import etag, stag, wtext
-from dg.textfmt import LineAccumulator
+from dg.textfmt import LineAccumulator, write_lines
 from dg.util import langsort, langsort_tuples
 from dg.util import mkdirpath
 from dg.construct import Text, Para
@@ -131,7 +130,8 @@ class Subcommand (object):
                   % dict(env=self._env))
         self._pivoted = (self._env is not None) or (not gloss.environments)
 
-        # Environments by weight, descending (for picking and sorting).
+        # Environments by weight, descending (for picking and sorting),
+        # and by key within same weight, for reproducible output.
         ebv = {}
         for eobj in self._gloss.environments.values():
             weight = eobj.weight or 0
@@ -139,10 +139,11 @@ class Subcommand (object):
                 ebv[weight] = []
             ebv[weight].append(eobj.id)
         for elst in ebv.itervalues():
-            random.shuffle(elst)
+            elst.sort()
         ebv = ebv.items()
         ebv.sort(lambda x, y: cmp(y[0], x[0]))
         self._envs_by_weight = ebv
+        self._envs_picking = [y for x in ebv for y in x[1]]
 
         # Create directory structure and copy overscaffolding.
         chunked = self._options.chunk not in ["none"]
@@ -174,40 +175,35 @@ class Subcommand (object):
         self._concepts_fname = "concepts.html"
         self._index_fname = "terms.html"
 
+        # Pages are written out as they are formatted.
+
         # - top
-        accl = LineAccumulator(self._indent)
-        self._fmt_prologue(accl)
-        self._fmt_top(accl.newind(2), chunked)
-        self._fmt_epilogue(accl)
-        accl.write(os.path.join(root_dir, self._top_fname))
+        self._write_page(os.path.join(root_dir, self._top_fname), "",
+                         self._fmt_top, chunked)
 
         # - concepts
         if self._options.chunk == "none":
             self._crtop = ""
-            accl = LineAccumulator(self._indent)
             concepts = pages_concepts[0][1]
-            self._fmt_prologue(accl)
-            self._fmt_header_concepts(accl.newind(2), concepts, "", 1)
-            self._fmt_concepts(accl.newind(2), concepts, 1)
-            self._fmt_epilogue(accl)
-            accl.write(os.path.join(root_dir, self._concepts_fname))
+            def fmt_concepts (accl):
+                self._fmt_header_concepts(accl, concepts, "", 1)
+                self._fmt_concepts(accl, concepts, 1)
+            self._write_page(os.path.join(root_dir, self._concepts_fname), "",
+                             fmt_concepts)
 
         else:
             self._crtop = ".." # return to root from a concepts page
             for page, concepts in pages_concepts:
-                accl = LineAccumulator(self._indent)
-                self._fmt_prologue(accl, self._crtop)
-                self._fmt_header_concepts(accl.newind(2), concepts, page)
-                self._fmt_concepts(accl.newind(2), concepts)
-                self._fmt_epilogue(accl)
-                accl.write(os.path.join(concept_dir, pages_to_filenames[page]))
+                def fmt_concepts (accl):
+                    self._fmt_header_concepts(accl, concepts, page)
+                    self._fmt_concepts(accl, concepts)
+                self._write_page(os.path.join(concept_dir,
+                                              pages_to_filenames[page]),
+                                 self._crtop, fmt_concepts)
 
         # - terms index
-        accl = LineAccumulator(self._indent)
-        self._fmt_prologue(accl)
-        self._fmt_index(accl.newind(2))
-        self._fmt_epilogue(accl)
-        accl.write(os.path.join(root_dir, self._index_fname))
+        self._write_page(os.path.join(root_dir, self._index_fname), "",
+                         self._fmt_index)
 
         # - global data
         self._artop = ""
@@ -235,14 +231,7 @@ class Subcommand (object):
         if self._pivoted:
             return dset(self._lang, self._env)
         else:
-            for weight, envs in self._envs_by_weight:
-                for env in envs:
-                    pick = dset(self._lang, env)
-                    if pick:
-                        break
-                if pick:
-                    break
-            return pick
+            return dset.first(self._lang, self._envs_picking)
 
 
     def _key_term (self, concept):
@@ -1546,11 +1535,18 @@ class Subcommand (object):
 
     def _fmt_global (self, fmt_global_x, fpath):
 
-        accl = LineAccumulator(self._indent)
-        self._fmt_prologue(accl, base=self._artop)
-        fmt_global_x(accl.newind(2))
-        self._fmt_epilogue(accl)
-        accl.write(fpath)
+        self._write_page(fpath, self._artop, fmt_global_x)
+
+
+    # Write a page, formatting its body by the given function
+    # called with the writer and any further arguments.
+    def _write_page (self, fpath, base, fmt_body, *args):
+
+        def fmt_page (accl):
+            self._fmt_prologue(accl, base)
+            fmt_body(accl.newind(2), *args)
+            self._fmt_epilogue(accl)
+        write_lines(fpath, fmt_page, self._indent)
 
 
     def _fmt_global_entry_basics (self, accl, gobj):
@@ -303,6 +303,19 @@ class Subcommand (object):
         accl(wtext(tlname, "th", {"class":"bd-header-tl"}), 2)
         accl(etag("tr"), 1)
 
+        # Separators and formats for entries, same in all of them.
+        lsep_dc = p_("list separator: "
+                     "acceptable variants of the same declension",
+                     ", ")
+        fmt_dcgr = p_("declension group: single declension given "
+                      "by its name and acceptable variants",
+                      "<i>%(dname)s</i> %(dvars)s")
+        lsep_gr = p_("list separator: "
+                     "declension groups",
+                     "; ")
+        lsep_tt = p_("list separator: synonymous terms",
+                     ", ")
+
         # Entries by origin term.
         anchored = {}
         n_entry = 0
@@ -378,15 +391,6 @@ class Subcommand (object):
                 tterms_compgr = []
                 for tterm in tterms:
                     # Declensions.
-                    lsep_dc = p_("list separator: "
-                                 "acceptable variants of the same declension",
-                                 ", ")
-                    fmt_dcgr = p_("declension group: single declension given "
-                                  "by its name and acceptable variants",
-                                  "<i>%(dname)s</i> %(dvars)s")
-                    lsep_gr = p_("list separator: "
-                                 "declension groups",
-                                 "; ")
                     tdecl = None
                     if tterm in tdecls:
                         lst = []
@@ -434,8 +438,6 @@ class Subcommand (object):
                     accl(etag("div"), 4)
 
                 # Line with terms.
-                lsep_tt = p_("list separator: synonymous terms",
-                             ", ")
                 ttstr = lsep_tt.join(tterms_compgr)
                 if len(tterms_ckeys) > 1:
                     ttstr = p_("enumerated target term in the dictionary, "
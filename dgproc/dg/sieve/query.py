@@ -0,0 +1,170 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Select data from the glossary by a path expression and output it.
+
+The path expression is given by the C{path} parameter, for example::
+
+    $ dgproc.py query -s path:'concepts[topic=astro]/term[lang=en]/nom' \
+                gloss.xml
+
+See L{dg.query.compile_path} for the syntax of path expressions.
+
+Each selected value is output in plain text on its own line,
+or, with C{format:json}, as an element of a JSON array.
+In JSON, glossary nodes are objects with their type, their attributes
+stating keys or plain strings, their text and texts of their single
+child nodes (e.g. C{nom} of a term), and the key of the concept
+which they belong to.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import sys
+import json
+
+from dg.util import p_
+from dg.util import error
+from dg.textfmt import TextFormatterPlain
+from dg.construct import Gnode, Concept, Text, _gnode_items, _TextSource
+from dg.query import select_path
+
+
+def fill_optparser (parser_view):
+
+    pv = parser_view
+
+    pv.set_desc(p_("subcommand description",
+                   "Select data from the glossary by a path expression "
+                   "and output it as plain text or JSON."))
+
+    pv.add_subopt("path", str,
+                  metavar=p_("placeholder for parameter value", "PATH"),
+                  desc=p_("subcommand option description",
+                          "Path expression selecting the data, "
+                          "e.g. 'concepts[topic=astro]/term[lang=en]/nom'."))
+    pv.add_subopt("format", str, defval="text", admvals=["text", "json"],
+                  metavar=p_("placeholder for parameter value", "FORMAT"),
+                  desc=p_("subcommand option description",
+                          "Output format, plain text or JSON."))
+    pv.add_subopt("lang", str, defval="",
+                  metavar=p_("placeholder for parameter value", "LANGKEY"),
+                  desc=p_("subcommand option description",
+                          "Language for formatting text. The glossary "
+                          "default language is used if not given."))
+    pv.add_subopt("env", str, defval="",
+                  metavar=p_("placeholder for parameter value", "ENVKEY"),
+                  desc=p_("subcommand option description",
+                          "Environment for formatting text. The glossary "
+                          "default environment is used if not given."))
+    pv.add_subopt("file", str, defval="",
+                  metavar=p_("placeholder for parameter value", "FILE"),
+                  desc=p_("subcommand option description",
+                          "File to output the results into "
+                          "(defaults to stdout)."))
+
+
+class Subcommand (object):
+
+    def __init__ (self, options, global_options):
+
+        self._options = options
+
+
+    def __call__ (self, gloss):
+
+        # Resolve language and environment.
+        lang = self._options.lang or gloss.lang
+        if lang is not None and lang not in gloss.languages:
+            error(p_("error message",
+                     "language '%(lang)s' does not exist in the glossary")
+                    % dict(lang=lang))
+
+        env = self._options.env or gloss.env[0]
+        if env is not None and env not in gloss.environments:
+            error(p_("error message",
+                     "environment '%(env)s' does not exist in the glossary")
+                  % dict(env=env))
+
+        self._tfm = TextFormatterPlain(gloss, lang=lang, env=env)
+
+        # Select data, compiling the path before opening the output,
+        # so that it is not created for an invalid path.
+        results = select_path(gloss, self._options.path)
+
+        outf = sys.stdout
+        if self._options.file:
+            outf = open(self._options.file, "w")
+
+        # Output results as they are selected.
+        if self._options.format == "json":
+            sep = "[\n"
+            for result in results:
+                outf.write(sep)
+                outf.write(json.dumps(self._json_value(result),
+                                      ensure_ascii=False, sort_keys=True))
+                sep = ",\n"
+            if sep == "[\n":
+                outf.write("[")
+            outf.write("\n]\n")
+        else:
+            for result in results:
+                outf.write(self._text_value(result) + "\n")
+
+        if outf is not sys.stdout:
+            outf.close()
+
+        # All done.
+
+
+    def _text_value (self, obj):
+
+        if isinstance(obj, basestring):
+            return obj
+        elif isinstance(obj, Text):
+            return self._tfm(obj)
+        elif isinstance(obj, Gnode):
+            text = getattr(obj, "text", None)
+            if isinstance(text, Text):
+                return self._tfm(text)
+            ckey = getattr(obj, "id", None)
+            if isinstance(ckey, basestring):
+                return ckey
+            return obj.__class__.__name__.lower()
+        else:
+            return unicode(obj)
+
+
+    def _json_value (self, obj):
+
+        if isinstance(obj, (basestring, int, float)):
+            return obj
+        elif isinstance(obj, Text):
+            return self._tfm(obj)
+        elif isinstance(obj, Gnode):
+            jobj = {"type": obj.__class__.__name__.lower()}
+            for att, val in _gnode_items(obj):
+                if att == "parent" or att.startswith("_"):
+                    continue
+                if isinstance(val, _TextSource):
+                    val = getattr(obj, att)
+                if isinstance(val, basestring):
+                    jobj[att] = val
+                elif isinstance(val, Text):
+                    jobj[att] = self._tfm(val)
+                elif (    isinstance(val, Gnode)
+                      and isinstance(getattr(val, "text", None), Text)):
+                    jobj[att] = self._tfm(val.text)
+                elif (    isinstance(val, (list, tuple))
+                      and all(isinstance(x, basestring) for x in val)):
+                    jobj[att] = list(val)
+            # Concept which the node belongs to.
+            gnode = obj
+            while gnode is not None and not isinstance(gnode, Concept):
+                gnode = gnode.parent
+            if gnode is not None and gnode is not obj:
+                jobj["concept"] = gnode.id
+            return jobj
+        else:
+            return self._text_value(obj)
@@ -39,7 +39,7 @@ class Subcommand (object):
             return gloss
 
         # Convert text in all nodes where it exists and is in Serbian.
-        for gnode in dg.query.descendant_nodes(gloss):
+        for gnode in dg.query.iter_descendants(gloss):
             if getattr(gnode, "lang", "") == srkey:
                 gnode.lang = srlatkey
                 if hasattr(gnode, "text"):
@@ -48,7 +48,7 @@ class Subcommand (object):
             gloss.lang = srlatkey
 
         # Convert Wikipedia root links.
-        for gnode in dg.query.descendant_nodes(gloss, dg.construct.Extroot):
+        for gnode in dg.query.iter_descendants(gloss, dg.construct.Extroot):
             for i in range(len(gnode.rooturl.text)):
                 url = gnode.rooturl.text[i]
                 if "sr.wikipedia" in url:
@@ -60,7 +60,7 @@ class Subcommand (object):
         gloss.languages[srlatkey] = serbian
 
         # Convert language ID in all d-sets too.
-        for dset in dg.query.descendant_dsets(gloss):
+        for dset in dg.query.iter_dsets(gloss):
             dset.rename_lang(srkey, srlatkey)
 
         return gloss
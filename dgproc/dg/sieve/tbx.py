@@ -30,7 +30,7 @@ from dg.util import p_
 from dg.util import error, warning
 from dg.textfmt import TextFormatterPlain, TextFormatterHtml
 from dg.textfmt import etag, stag, wtext, escape_xml
-from dg.textfmt import LineAccumulator
+from dg.textfmt import write_lines
 from dg.util import langsort, langsort_tuples
 from dg.util import mkdirpath
 from dg.util import lstr
@@ -96,17 +96,16 @@ class Subcommand (object):
         self._tf = TextFormatterPlain(gloss, lang=self._lang, env=self._env,
                                       escape=escape_xml)
 
-        # Create TBX.
-        accl = LineAccumulator(self._indent)
-        self._fmt_prologue(accl)
-        self._fmt_concepts(accl.newind(2), concepts)
-        self._fmt_epilogue(accl)
-
+        # Create TBX, writing it out as it is formatted.
         if self._options.file:
             tbx_fname = self._options.file
         else:
             tbx_fname = gloss.id + ".tbx"
-        accl.write(tbx_fname)
+        def fmt_tbx (accl):
+            self._fmt_prologue(accl)
+            self._fmt_concepts(accl.newind(2), concepts)
+            self._fmt_epilogue(accl)
+        write_lines(tbx_fname, fmt_tbx, self._indent)
 
 
     def _select_concepts (self):
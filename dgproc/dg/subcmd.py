@@ -113,7 +113,7 @@ class SubcmdHandler (object):
         for pack, cat in subcmd_reg_bundle:
 
             modfiles = fnmatch.filter(os.listdir(pack.__path__[0]), "[a-z]*.py")
-            subcmds = [x.rstrip(".py").replace("_", "-") for x in modfiles]
+            subcmds = [x[:-len(".py")].replace("_", "-") for x in modfiles]
             self._packs[pack] = True
             self._cats[pack] = cat
             self._subcmds[pack] = subcmds
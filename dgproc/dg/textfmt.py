@@ -7,15 +7,56 @@ Format text in glossary for different outputs.
 @license: GPLv3
 """
 
+import os
 import re
 from textwrap import TextWrapper
 import copy
 import codecs
+from collections import OrderedDict
 
 from dg.util import p_
+from dg.util import error
 from dg.construct import Text, Para, Ref, Em, Ol, Link
 
 
+_ws_rx = re.compile(r"\s+")
+_html_line_end_rx = re.compile(r"(</(p|ul|li)>)")
+
+
+# Bounded cache of formatted texts, with least recently used
+# texts dropped first. Texts are keyed by identity together with
+# the formatting parameters, and kept referenced while in the cache,
+# so that their identities cannot be reused.
+class _FormatCache (object):
+
+    def __init__ (self, size):
+
+        self._size = size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get (self, key, text):
+
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] is not text:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+
+    def put (self, key, text, fmt_text):
+
+        if self._size <= 0:
+            return
+        self._entries[key] = (text, fmt_text)
+        if len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+
 class TextFormatterPlain (object):
     """
     Format divergloss text into plain text.
@@ -23,12 +64,17 @@ class TextFormatterPlain (object):
 
     def __init__ (self, gloss, lang=None, env=None,
                         wcol=None, indent=None, first_indent=None,
-                        prefix=None, suffix=None, escape=None):
+                        prefix=None, suffix=None, escape=None,
+                        cachesize=10000):
         """
         Constructor.
 
         If the language or environment is C{None}, the glossary default is used.
 
+        Formatted texts are cached, up to the given number of most recently
+        formatted ones, so texts must not be modified while being formatted
+        by the same formatter.
+
         @param gloss: the glossary to which the text belongs
         @type gloss: L{Glossary}
 
@@ -55,6 +101,9 @@ class TextFormatterPlain (object):
 
         @param escape: escaping function to apply to text
         @type escape: callable (string) -> string or C{None}
+
+        @param cachesize: number of formatted texts to cache
+        @type cachesize: int
         """
 
         self._gloss = gloss
@@ -80,6 +129,8 @@ class TextFormatterPlain (object):
                                         subsequent_indent=indent,
                                         width=wcol)
 
+        self._cache = _FormatCache(cachesize)
+
 
     def __call__ (self, text, prefix=None, suffix=None):
         """
@@ -101,14 +152,21 @@ class TextFormatterPlain (object):
         @rtype: string
         """
 
+        prefix = prefix or self._prefix
+        suffix = suffix or self._suffix
+
+        # Reuse earlier formatting if possible.
+        ckey = (id(text), prefix, suffix)
+        fmt_text = self._cache.get(ckey, text)
+        if fmt_text is not None:
+            return fmt_text
+
         # Basic format, resolve tags.
         fmt_text = self._format_sub(text)
 
         # Prefixate and suffixate if requested.
-        prefix = prefix or self._prefix
         if prefix:
             fmt_text = prefix + fmt_text
-        suffix = suffix or self._suffix
         if suffix:
             fmt_text = fmt_text + suffix
 
@@ -116,7 +174,7 @@ class TextFormatterPlain (object):
         fmt_lines = fmt_text.strip("\x04").split("\x04")
 
         # Strip superfluous whitespace.
-        fmt_lines = [re.sub("\s+", " ", x).strip() for x in fmt_lines]
+        fmt_lines = [_ws_rx.sub(" ", x).strip() for x in fmt_lines]
 
         # Wrap if requested, or just indent.
         if self._wrapper:
@@ -134,9 +192,22 @@ class TextFormatterPlain (object):
         # Put lines back into single string.
         fmt_text = "\n".join(fmt_lines)
 
+        self._cache.put(ckey, text, fmt_text)
+
         return fmt_text
 
 
+    def cache_stats (self):
+        """
+        Report how often formatted texts were reused.
+
+        @return: number of cache hits and misses
+        @rtype: (int, int)
+        """
+
+        return self._cache.hits, self._cache.misses
+
+
     def _format_sub (self, text):
 
         fmt_text = []
@@ -194,12 +265,14 @@ class TextFormatterHtml (object):
     def __init__ (self, gloss, lang=None, env=None,
                         prefix=None, suffix=None, refbase=None,
                         wtag=None, wattrs=None, wcond=True,
-                        pclass=None):
+                        pclass=None, cachesize=10000):
         """
         Constructor.
 
         If the language or environment is C{None}, the glossary default is used.
 
+        Formatted texts are cached, as in L{TextFormatterPlain}.
+
         References in the text are linked as C{base#ckey},
         where C{ckey} is the concept key as pointed to by the reference,
         and C{base} is the page where the concept is anchored.
@@ -237,6 +310,9 @@ class TextFormatterHtml (object):
 
         @param pclass: class attribute to assign to paragraphs
         @type pclass: string or C{None}
+
+        @param cachesize: number of formatted texts to cache
+        @type cachesize: int
         """
 
         self._gloss = gloss
@@ -252,6 +328,8 @@ class TextFormatterHtml (object):
 
         self._refbase = refbase
 
+        self._cache = _FormatCache(cachesize)
+
 
     def __call__ (self, text, prefix=None, suffix=None,
                   wtag=None, wattrs=None, wcond=None,
@@ -289,30 +367,38 @@ class TextFormatterHtml (object):
         @rtype: string
         """
 
-        # Basic format, resolve tags.
         pclass = pclass or self._pclass
+        prefix = prefix or self._prefix
+        suffix = suffix or self._suffix
+        wtag = wtag or self._wtag
+        wattrs = wattrs or self._wattrs
+        if wcond is None:
+            wcond = self._wcond
+
+        # Reuse earlier formatting if possible.
+        ckey = (id(text), prefix, suffix, wtag,
+                wattrs and tuple(sorted(wattrs.items())), wcond, pclass)
+        fmt_text = self._cache.get(ckey, text)
+        if fmt_text is not None:
+            return fmt_text
+
+        # Basic format, resolve tags.
         fmt_text = self._format_sub(text, pclass)
 
         # Prefixate and suffixate if requested.
-        prefix = prefix or self._prefix
         if prefix:
             fmt_text = prefix + fmt_text
-        suffix = suffix or self._suffix
         if suffix:
             fmt_text = fmt_text + suffix
 
         # Strip superfluous whitespace.
-        fmt_text = re.sub("\s+", " ", fmt_text).strip()
+        fmt_text = _ws_rx.sub(" ", fmt_text).strip()
 
         # Split into lines by some closing tags.
-        tmp = re.sub(r"(</(p|ul|li)>)", "\\1\n", fmt_text).strip()
+        tmp = _html_line_end_rx.sub("\\1\n", fmt_text).strip()
         fmt_lines = [x.strip() for x in tmp.split("\n")]
 
         # Wrap if requested.
-        wtag = wtag or self._wtag
-        wattrs = wattrs or self._wattrs
-        if wcond is None:
-            wcond = self._wcond
         if wtag and (not wcond or not fmt_text.startswith("<" + wtag)):
             rwattrs = wattrs
             if wtag.lower() == "p" and pclass:
@@ -326,7 +412,22 @@ class TextFormatterHtml (object):
             else:
                 fmt_lines[0] = wtext(fmt_lines[0], wtag, rwattrs)
 
-        return "\n".join(fmt_lines)
+        fmt_text = "\n".join(fmt_lines)
+
+        self._cache.put(ckey, text, fmt_text)
+
+        return fmt_text
+
+
+    def cache_stats (self):
+        """
+        Report how often formatted texts were reused.
+
+        @return: number of cache hits and misses
+        @rtype: (int, int)
+        """
+
+        return self._cache.hits, self._cache.misses
 
 
     def _format_sub (self, text, pclass=None):
@@ -384,6 +485,8 @@ class TextFormatterHtml (object):
         return "".join(fmt_text)
 
 
+_xml_special_rx = re.compile(r"[&<>'\"]")
+
 def escape_xml (text):
     """
     Escape plain text to be valid in XML context, using entities.
@@ -395,13 +498,20 @@ def escape_xml (text):
     @rtype: string
     """
 
-    text = text.replace("&", "&amp;") # must be first
-    text = text.replace("'", "&quot;")
-    text = text.replace('"', "&apos;")
-    text = text.replace("<", "&lt;")
-    text = text.replace(">", "&gt;")
+    # Most texts have nothing to escape.
+    if _xml_special_rx.search(text) is None:
+        return text
+
+    return (text.replace("&", "&amp;") # must be first
+                .replace("'", "&apos;")
+                .replace('"', "&quot;")
+                .replace("<", "&lt;")
+                .replace(">", "&gt;"))
 
-    return text
+
+# Formatted attributes of starting tags, by attribute items.
+_stag_attrs_cache = {}
+_stag_attrs_cache_size = 10000
 
 
 def stag (tag, attrs=None, close=False):
@@ -420,11 +530,15 @@ def stag (tag, attrs=None, close=False):
     """
 
     fmt_attr = ""
-    if attrs is not None:
-        atts_vals = attrs.items()
-        atts_vals = [(x[0], escape_xml(x[1])) for x in atts_vals]
-        atts_vals.sort(lambda x, y: cmp(x[0], y[0]))
-        fmt_attr = "".join([" %s='%s'" % x for x in atts_vals])
+    if attrs:
+        akey = tuple(attrs.iteritems())
+        fmt_attr = _stag_attrs_cache.get(akey)
+        if fmt_attr is None:
+            fmt_attr = "".join([" %s='%s'" % (x, escape_xml(attrs[x]))
+                                for x in sorted(attrs)])
+            if len(_stag_attrs_cache) >= _stag_attrs_cache_size:
+                _stag_attrs_cache.clear()
+            _stag_attrs_cache[akey] = fmt_attr
 
     cslash = ""
     if close:
@@ -462,7 +576,7 @@ def wtext (text, tag, attrs=None):
     @rtype: string
     """
 
-    return stag(tag, attrs) + text + etag(tag)
+    return "%s%s</%s>" % (stag(tag, attrs), text, tag)
 
 
 def itext (indent, text, strip=False, empty=False):
@@ -523,6 +637,7 @@ class LineAccumulator (object):
         self._ilevel = ilevel
         self._strip = strip
         self._empty = empty
+        self._indents = {}
 
         self.lines = []
 
@@ -540,19 +655,43 @@ class LineAccumulator (object):
         @type level: int >= 0
         """
 
-        if isinstance(text, LineAccumulator):
+        self.lines.extend(self._indent_lines(text, level))
+
+
+    # Indent given text or lines, and terminate each line with newline.
+    def _indent_lines (self, text, level):
+
+        if isinstance(text, LineWriter):
+            error(p_("error message",
+                     "lines given to a line writer cannot be taken "
+                     "from another line writer"))
+        elif isinstance(text, LineAccumulator):
             lines = text.lines
         elif isinstance(text, (str, unicode)):
             lines = [text]
         else:
             lines = list(text)
 
+        ilevel = self._ilevel + level
+        cindent = self._indents.get(ilevel)
+        if cindent is None:
+            cindent = self._indent * ilevel
+            self._indents[ilevel] = cindent
+
+        nlines = []
         for text in lines:
-            cindent = self._indent * (self._ilevel + level)
-            text = itext(cindent, text, self._strip, self._empty)
+            if "\n" in text:
+                text = itext(cindent, text, self._strip, self._empty)
+            else:
+                if self._strip:
+                    text = text.strip()
+                if self._empty or text.strip():
+                    text = cindent + text
             if not text.endswith("\n"):
                 text += "\n"
-            self.lines.append(text)
+            nlines.append(text)
+
+        return nlines
 
 
     def newind (self, dlevel=1):
@@ -602,3 +741,132 @@ class LineAccumulator (object):
         self.lines.extend(ifl.readlines())
         ifl.close()
 
+
+class LineWriter (LineAccumulator):
+    """
+    A writer of lines of text into a file.
+
+    Lines are given in the same way as to L{LineAccumulator},
+    but are written to the file as they come, instead of being kept
+    in memory, so the C{lines} member variable stays empty.
+    The writer must be closed once all lines have been given,
+    or discarded if formatting fails, so that no partial file remains;
+    L{write_lines} takes care of both.
+    """
+
+    def __init__ (self, fpath, indent="  ", ilevel=0, strip=False,
+                  empty=False, enc="UTF-8"):
+        """
+        Constructor.
+
+        @param fpath: path of the file to write
+        @type fpath: string
+        @param indent: line indent per level
+        @type indent: string
+        @param ilevel: base indenting level
+        @type ilevel: int >= 0
+        @param strip: whether to strip lines before indenting
+        @type strip: bool
+        @param empty: whether to indent empty lines too
+        @type empty: bool
+        @param enc: encoding for the text
+        @type enc: string
+        """
+
+        LineAccumulator.__init__(self, indent, ilevel, strip, empty)
+
+        self._fpath = fpath
+        self._ofl = codecs.open(fpath, "w", enc)
+
+
+    def __call__ (self, text="", level=0):
+        """
+        Write line of text, with given indent level.
+
+        See L{LineAccumulator.__call__} for details.
+
+        @param text: text to write
+        @type text: string, list of strings, or a L{LineAccumulator}
+        @param level: indenting level
+        @type level: int >= 0
+        """
+
+        self._ofl.writelines(self._indent_lines(text, level))
+
+
+    def write (self, fpath, enc="UTF-8"):
+        """
+        Not available, as lines are written to the writer's own file.
+
+        @param fpath: path of the file to write
+        @type fpath: string
+        @param enc: encoding for the text
+        @type enc: string
+        """
+
+        error(p_("error message",
+                 "lines given to a line writer cannot be written "
+                 "to another file '%(file)s'")
+              % dict(file=fpath))
+
+
+    def read (self, fpath, enc="UTF-8"):
+        """
+        Write lines from the file into the writer's own file.
+
+        @param fpath: path of the file to read
+        @type fpath: string
+        @param enc: encoding for the text
+        @type enc: string
+        """
+
+        ifl = codecs.open(fpath, "r", enc)
+        self._ofl.writelines(ifl.readlines())
+        ifl.close()
+
+
+    def close (self):
+        """
+        Close the file, after writing out any buffered lines.
+
+        Writers with different indent levels obtained by L{newind}
+        share the file, so it should be closed only once.
+        """
+
+        self._ofl.close()
+
+
+    def discard (self):
+        """
+        Close and remove the file, when not all lines could be given.
+        """
+
+        self._ofl.close()
+        os.remove(self._fpath)
+
+
+def write_lines (fpath, fmt_lines, indent="  ", enc="UTF-8"):
+    """
+    Write lines into a file as they are formatted.
+
+    The formatting function is given a L{LineWriter} into the file.
+    If the function fails, the partially written file is removed,
+    and the exception is let through.
+
+    @param fpath: path of the file to write
+    @type fpath: string
+    @param fmt_lines: function giving lines to the writer
+    @type fmt_lines: (L{LineWriter}) -> any
+    @param indent: line indent per level
+    @type indent: string
+    @param enc: encoding for the text
+    @type enc: string
+    """
+
+    accl = LineWriter(fpath, indent, enc=enc)
+    try:
+        fmt_lines(accl)
+    except:
+        accl.discard()
+        raise
+    accl.close()
@@ -9,6 +9,8 @@ Various utilities.
 
 import sys, os, locale
 
+from dg.collate import collator, collation_languages
+
 _cmdname = os.path.basename(sys.argv[0])
 
 # --------------------------------------
@@ -46,14 +48,27 @@ def _(msgid):
     return msgstr
 """
 
+# Translations already looked up, by call arguments.
+_tr_cache = {}
+
+# Number of translation calls, and of those looked up in the catalog.
+_tr_counts = [0, 0]
+
 # Context call.
 def p_(msgctxt, msgid):
 
+    _tr_counts[0] += 1
+    msgstr = _tr_cache.get((msgctxt, msgid))
+    if msgstr is not None:
+        return msgstr
+    _tr_counts[1] += 1
+
     cmsgid = msgctxt + "\x04" + msgid
     msgstr = _tr.ugettext(cmsgid)
     p = msgstr.find("\x04")
     if p > 0:
         msgstr = msgstr[p+1:]
+    _tr_cache[(msgctxt, msgid)] = msgstr
     return msgstr
 
 
@@ -67,51 +82,79 @@ def n_(msgid, msgid_plural, n):
 """
 
 # Plural with context call.
+# Translations are remembered by plural form rather than by the number,
+# so that formatting many different numbers does not grow the cache.
+# Untranslated messages take the singular only for one, whatever the form.
 def np_(msgctxt, msgid, msgid_plural, n):
 
+    _tr_counts[0] += 1
+    key = (msgctxt, msgid, msgid_plural, _tr_plural(n), n == 1)
+    msgstr = _tr_cache.get(key)
+    if msgstr is not None:
+        return msgstr
+    _tr_counts[1] += 1
+
     cmsgid = msgctxt + "\x04" + msgid
     msgstr = _tr.ungettext(cmsgid, msgid_plural, n)
     p = msgstr.find("\x04")
     if p > 0:
         msgstr = msgstr[p+1:]
+    _tr_cache[key] = msgstr
     return msgstr
 
 
+# Plural form of the catalog for the number.
+def _tr_plural (n):
+
+    plural = getattr(_tr, "plural", None)
+    if plural is None:
+        return int(n != 1)
+    return plural(n)
+
+
+def tr_stats ():
+    """
+    Report how many translations were requested.
+
+    Each distinct translation call is looked up in the catalog only once,
+    and repeated calls are served from memory.
+
+    @return: number of translation calls, and of catalog lookups
+    @rtype: (int, int)
+    """
+
+    return tuple(_tr_counts)
+
+
 # --------------------------------------
 # Language-aware sorting.
 
-_lang_to_locale = {
-    "en": [
-        "en_US.UTF-8", "en_US.UTF8", "en_US", "english",
-    ],
-    "sr": [
-        "sr_RS.UTF-8", "sr_CS.UTF-8", "sr_RS",
-    ],
-    "sr@latin": [
-        "sr_RS.UTF-8@latin", "sr_CS.UTF-8@latin", "sr_RS@latin",
-    ],
-    "ja": [
-        "ja_JP.UTF-8",
-    ],
-}
+# Languages with collation tables in dg.collate are sorted by them,
+# and other languages by system locales, where found.
+_table_langs = set(collation_languages())
 
 _no_locale_warning_issued = {}
 
+# Locales resolved by language, None where none could be found.
+_lang_locnames = {}
+
 # Set locale for requested language, and return reset function.
 def _set_lang_locale (lang):
 
-    if lang is None:
+    if lang is None or _lang_locnames.get(lang, True) is None:
         return lambda: True
 
-    # Get possible locales from explicit mapping,
-    # try auto-resolution as lower priority (not very reliable).
-    nlocnames = _lang_to_locale.get(lang, [])
-    nlocname_auto = locale.normalize(lang + ".UTF-8")
-    if nlocname_auto not in nlocnames:
-        nlocnames.append(nlocname_auto)
+    oldloc = locale.setlocale(locale.LC_ALL)
+
+    # Switch directly to the locale resolved earlier.
+    if lang in _lang_locnames:
+        locale.setlocale(locale.LC_ALL, _lang_locnames[lang])
+        return lambda: locale.setlocale(locale.LC_ALL, oldloc)
+
+    # Get possible locales by auto-resolution (not very reliable).
+    nlocnames = [locale.normalize(lang + ".UTF-8")]
 
     # Try to set one of the locales.
-    oldloc = locale.getlocale()
     setlocname = None
     for nlocname in nlocnames:
         try:
@@ -119,6 +162,7 @@ def _set_lang_locale (lang):
             break
         except:
             pass
+    _lang_locnames[lang] = setlocname
     if setlocname is None and lang not in _no_locale_warning_issued:
         warning(p_("error message",
                     "cannot find a locale for language '%(lang)s', "
@@ -131,21 +175,72 @@ def _set_lang_locale (lang):
     return lambda: locale.setlocale(locale.LC_ALL, oldloc)
 
 
+# Collation keys of strings, by collation locale.
+_collation_keys = {}
+
+# Get collation keys for given strings in the given language,
+# as mapping from strings to keys.
+# Languages without collation tables and without system locale
+# get the language-independent collation from dg.collate.
+# The locale is switched only when there are strings without a key.
+# Locales are assumed to use UTF-8.
+def _lang_sort_keys (strings, lang):
+
+    if lang is not None:
+        if lang not in _table_langs and lang not in _lang_locnames:
+            _set_lang_locale(lang)()
+        if lang in _table_langs or _lang_locnames[lang] is None:
+            return collator(lang).sort_keys(strings)
+
+    locname = _lang_locnames.get(lang)
+    if locname is None:
+        locname = locale.setlocale(locale.LC_COLLATE)
+
+    keys = _collation_keys.get(locname)
+    if keys is None:
+        keys = {}
+        _collation_keys[locname] = keys
+
+    missing = [x for x in strings if x not in keys]
+    if missing:
+        reset_locale = _set_lang_locale(lang)
+        for text in missing:
+            if isinstance(text, unicode):
+                keys[text] = locale.strxfrm(text.encode("UTF-8"))
+            else:
+                keys[text] = locale.strxfrm(text)
+        reset_locale()
+
+    return keys
+
+
 def langsort (lst, lang=None):
     """
     Sort a list of words using collation of the given language.
 
+    Languages with collation tables in L{dg.collate} are sorted
+    independently of system locales, and so are other languages
+    when there is no system locale for them.
     If C{lang} is C{None}, current locale is used for collation.
 
+    Collation by tables follows the alphabet of the language, with case
+    and diacritics deciding only between otherwise equal words. This is
+    unlike the code point order which was used when no system locale was
+    found for the language, so that words starting with uppercase letters
+    no longer come first, and e.g. for C{sr@latin} I{čaj} comes between
+    I{cvet} and I{dan} rather than after all other Latin words.
+
+    Collation keys are computed once per word and language,
+    and reused by subsequent sorts.
+
     @param lst: list to sort, in-place
     @type lst: list
     @param lang: language for the collation
     @type lang: string of C{None}
     """
 
-    reset_locale = _set_lang_locale(lang)
-    lst.sort(locale.strcoll)
-    reset_locale()
+    keys = _lang_sort_keys(lst, lang)
+    lst.sort(key=keys.__getitem__)
 
 
 def langsort_tuples (lst, index, lang=None):
@@ -155,6 +250,9 @@ def langsort_tuples (lst, index, lang=None):
 
     If C{lang} is C{None}, current locale is used for collation.
 
+    Collation keys are computed once per word and language,
+    as in L{langsort}.
+
     @param lst: list to sort, in-place
     @type lst: list of tuples
     @param index: sort by tuple elements at this position
@@ -163,9 +261,8 @@ def langsort_tuples (lst, index, lang=None):
     @type lang: string of C{None}
     """
 
-    reset_locale = _set_lang_locale(lang)
-    lst.sort(lambda x, y: locale.strcoll(x[index], y[index]))
-    reset_locale()
+    keys = _lang_sort_keys([x[index] for x in lst], lang)
+    lst.sort(key=lambda x: keys[x[index]])
 
 
 # --------------------------------------
@@ -16,6 +16,7 @@ sys.path.append(os.path.dirname(sys.argv[0]))
 from dg.util import p_
 from dg.util import error
 from dg.util import lstr
+from dg.util import tr_stats
 import dg.construct
 import dg.subcmd
 import dg.sieve
@@ -53,6 +54,47 @@ def main ():
         action="store_false", dest="check", default=True,
         help=p_("description of cmdline option",
                 "do not check the glossary for validity"))
+    opars.add_option(
+        "--stream",
+        action="store_true", dest="stream", default=False,
+        help=p_("description of cmdline option",
+                "construct the glossary while parsing the document, "
+                "to reduce memory use on large glossaries"))
+    opars.add_option(
+        "--lazy",
+        action="store_true", dest="lazy", default=False,
+        help=p_("description of cmdline option",
+                "construct each concept only when it is first accessed"))
+    opars.add_option(
+        "--compact",
+        action="store_true", dest="compact", default=False,
+        help=p_("description of cmdline option",
+                "store language and environment variants compactly "
+                "and texts in source form, using less memory"))
+    opars.add_option(
+        "--cache-dir",
+        metavar=p_("placeholder for value to cmdline option", "DIR"),
+        dest="cache_dir", default=None,
+        help=p_("description of cmdline option",
+                "keep the constructed glossary in a cache in this "
+                "directory, and reuse it while the document is unchanged"))
+    opars.add_option(
+        "-j", "--jobs",
+        metavar=p_("placeholder for value to cmdline option", "NUM"),
+        type="int", dest="jobs", default=1,
+        help=p_("description of cmdline option",
+                "construct included concepts subdocuments "
+                "in this many parallel processes"))
+    opars.add_option(
+        "--intern-stats",
+        action="store_true", dest="intern_stats", default=False,
+        help=p_("description of cmdline option",
+                "report memory saved by sharing keys in the glossary"))
+    opars.add_option(
+        "--tr-stats",
+        action="store_true", dest="tr_stats", default=False,
+        help=p_("description of cmdline option",
+                "report how many translation lookups were made"))
     opars.add_option(
         "-s", "--sieve-par",
         metavar=p_("placeholder for value to cmdline option", "PARSPEC"),
@@ -116,7 +158,12 @@ def main ():
         options)[0]
 
     # Construct the glossary.
-    gloss = dg.construct.from_file(dgfile, validate=options.check)
+    gloss = dg.construct.from_file(dgfile, validate=options.check,
+                                   stream=options.stream,
+                                   cachedir=options.cache_dir,
+                                   lazy=options.lazy,
+                                   jobs=options.jobs,
+                                   compact=options.compact)
 
     # Sieve the glossary.
     for sieve in sieves:
@@ -124,6 +171,23 @@ def main ():
         if ret is not None:
             gloss = ret
 
+    # Report on sharing of keys, after any concepts were constructed lazily.
+    if options.intern_stats:
+        nvals, ndups, nbytes = dg.construct.intern_stats(gloss)
+        print >>sys.stderr, (p_("message",
+                                "Shared keys: %(vals)d distinct values, "
+                                "%(dups)d duplicates replaced, "
+                                "%(bytes)d bytes saved.")
+                             % dict(vals=nvals, dups=ndups, bytes=nbytes))
+
+    # Report on translation lookups.
+    if options.tr_stats:
+        ncalls, nlookups = tr_stats()
+        print >>sys.stderr, (p_("message",
+                                "Translations: %(calls)d calls, "
+                                "%(lookups)d catalog lookups.")
+                             % dict(calls=ncalls, lookups=nlookups))
+
 
 if __name__ == '__main__':
     main()